@@ -1,86 +1,53 @@
 import streamlit as st
-import gspread
-import pandas as pd
-from google.oauth2.service_account import Credentials
 import uuid
 
-import json
-import os
 import random
 import re
+from datetime import datetime, timezone
 
-RESPONSE_BASE_PATH = "responses/gpt-4.1"
+from utils.corpus import ALTERNATIVE_AGENTS, BASELINE_AGENT, corpus_version, get_available_indices, load_response
+from utils.evaluation_store import get_evaluation_store, get_user_store, sync_stores
+from utils.rendering import SECTION_CSS, get_sections_html, render_markdown
+from utils.similarity import SIMILARITY_THRESHOLD, load_pair_similarity, similarity_to
 
 # Set wide layout
 st.set_page_config(layout="wide", page_title="AI for Climate Adaptation – Evaluation")
 
 
-def split_sections(response_text):
-    # Estrae blocchi principali (naive, da migliorare se serve)
-    sections = {}
-    current = None
-    for line in response_text.split("\n"):
-        line = line.strip()
-
-        # Salta linee che creano linee orizzontali
-        if line in ("---", "***", "___"):
-            continue
-
-        if line.lower().startswith("### executive summary"):
-            current = "Executive summary"
-            sections[current] = ""
-        elif line.lower().startswith("### uncertainty"):
-            current = "Uncertainty"
-            sections[current] = ""
-        elif line.lower().startswith("### actionability"):
-            current = "Actionability"
-            sections[current] = ""
-        elif line.lower().startswith("### credibility"):
-            current = "Credibility"
-            sections[current] = ""
-        elif current:
-            sections[current] += line + "\n"
-    return sections
-
-# === Caricamento risposte ===
-@st.cache_data
-def load_response(agent_name, idx):
-    path = os.path.join(RESPONSE_BASE_PATH, agent_name, f"response_{idx}.json")
-    with open(path, "r") as f:
-        return json.load(f)
-
 @st.cache_data
-def get_available_indices():
-    return [f.split("_")[1].split(".")[0] for f in os.listdir(os.path.join(RESPONSE_BASE_PATH, "Plain-LLM"))]
+def get_baseline_similarity(version):
+    """Similarità di ogni risposta alternativa con quella di Plain-LLM, come dict (question_id, agent) -> valore"""
+    return similarity_to(load_pair_similarity(version), BASELINE_AGENT).to_dict()
 
 def get_random_evaluation_pair(already_done):
     indices = get_available_indices()
     random.shuffle(indices)
-    others = ["Climsight", "Climsight-XCLIM", "XCLIM-AI"]
+    similarity = get_baseline_similarity(corpus_version())
 
     for idx in indices:
-        plain = load_response("Plain-LLM", idx)
-        alt_agent = random.choice(others)
+        # Le risposte quasi identiche a Plain-LLM si saltano, le più simili diventano meno probabili
+        candidates = [a for a in ALTERNATIVE_AGENTS if similarity.get(("Q" + idx, a), 0) < SIMILARITY_THRESHOLD]
+        if not candidates:
+            continue
+        plain = load_response(BASELINE_AGENT, idx)
+        weights = [1 - similarity.get(("Q" + idx, a), 0) for a in candidates]
+        alt_agent = random.choices(candidates, weights=weights)[0]
         alt = load_response(alt_agent, idx)
 
-        pair = [("Q" + idx, "Plain-LLM"), ("Q" + idx, alt["Agent"])]
+        pair = [("Q" + idx, BASELINE_AGENT), ("Q" + idx, alt["Agent"])]
         if not any(p in already_done for p in pair):
             return idx, plain, alt
 
     return None, None, None  # Nessuna nuova combinazione trovata
 
-# === Setup Google Sheet ===
-scope = ["https://www.googleapis.com/auth/spreadsheets"]
-credentials = Credentials.from_service_account_info(st.secrets["gspread"], scopes=scope)
-gc = gspread.authorize(credentials)
-sh = gc.open_by_url(st.secrets["gspread"]["sheet_url"])
-eval_ws = sh.worksheet("evaluations")
-user_ws = sh.worksheet("users")
-
 # === Funzioni di gestione utenti ===
 def check_user_exists(username):
-    """Controlla se l'username esiste già nel Google Sheet"""
-    users = pd.DataFrame(user_ws.get_all_records())
+    """Controlla se l'username esiste già nel Google Sheet.
+    Utenti e valutazioni vengono letti insieme, con un'unica lettura batch: dopo il
+    login le valutazioni dell'utente sono già in memoria."""
+    user_store = get_user_store()
+    sync_stores([user_store, get_evaluation_store()], force=True)
+    users = user_store.to_frame()
     if users.empty:
         return False, None
     user_row = users[users["username"] == username]
@@ -104,7 +71,7 @@ def create_new_user(username, background, role, institution, climate_experience=
     if motivation is None:
         motivation = "Not specified"
     
-    user_ws.append_row([
+    get_user_store().append([
         user_id,
         username,
         background,
@@ -118,8 +85,36 @@ def create_new_user(username, background, role, institution, climate_experience=
     ])
     return user_id
 
-def save_evaluation(user_id, question_id, agent, relevance, credibility, uncertainty, actionability):
-    eval_ws.append_row([user_id, question_id, agent, relevance, credibility, uncertainty, actionability])
+def save_evaluation(user_id, question_id, agent, relevance, credibility, uncertainty, actionability, timing):
+    # Write-through: la valutazione è subito visibile anche nella pagina Statistics
+    get_evaluation_store().append([user_id, question_id, agent, relevance, credibility, uncertainty, actionability] + timing)
+
+# === Tempi di valutazione ===
+RATING_SECTIONS = ["relevance", "credibility", "uncertainty", "actionability"]
+
+def mark_section(section):
+    """Callback degli slider: registra il primo momento in cui la sezione viene valutata"""
+    st.session_state.section_rated_at.setdefault(section, datetime.now(timezone.utc))
+
+def evaluation_timing(submitted_at):
+    """timestamp, shown_at, permanenza totale e per sezione (secondi) della coppia corrente.
+
+    Il tempo di una sezione va dal primo voto della sezione precedente (o dalla
+    comparsa della coppia) al primo voto della sezione stessa, nell'ordine della pagina.
+    """
+    shown_at = st.session_state.shown_at
+    rated_at = st.session_state.section_rated_at
+    section_seconds = []
+    previous = shown_at
+    for section in RATING_SECTIONS:
+        current = rated_at.get(section, submitted_at)
+        section_seconds.append(round(max((current - previous).total_seconds(), 0), 1))
+        previous = max(previous, current)
+    return [
+        submitted_at.isoformat(timespec="seconds"),
+        shown_at.isoformat(timespec="seconds"),
+        round((submitted_at - shown_at).total_seconds(), 1),
+    ] + section_seconds
 
 # === UI iniziale ===
 st.title("Evaluation")
@@ -299,10 +294,11 @@ with col1:
         st.rerun()
 
 # === Carica valutazioni precedenti dell'utente ===
-@st.cache_data(ttl=60)
 def load_user_evaluations(user_id):
-    df = pd.DataFrame(eval_ws.get_all_records())
-    return df[df["user_id"] == user_id] if not df.empty else pd.DataFrame()
+    store = get_evaluation_store()
+    store.sync()
+    df = store.to_frame()
+    return df[df["user_id"] == str(user_id)]
 
 user_eval_df = load_user_evaluations(st.session_state.user_id)
 already_done = set(tuple(x) for x in user_eval_df[["question_id", "agent"]].dropna().values.tolist())
@@ -330,6 +326,8 @@ if "eval_idx" not in st.session_state or st.session_state.get("force_refresh", F
     st.session_state.eval_idx = idx
     st.session_state.responses = responses
     st.session_state.force_refresh = False  # reset flag
+    st.session_state.shown_at = datetime.now(timezone.utc)
+    st.session_state.section_rated_at = {}
     
     # Rimuovi le chiavi degli slider per resettarli alla prossima inizializzazione
     slider_keys = [
@@ -341,6 +339,11 @@ if "eval_idx" not in st.session_state or st.session_state.get("force_refresh", F
             del st.session_state[k]
 
 
+# Sessioni iniziate prima che i tempi venissero registrati
+if "shown_at" not in st.session_state:
+    st.session_state.shown_at = datetime.now(timezone.utc)
+    st.session_state.section_rated_at = {}
+
 # === Mostra domanda e risposte ===
 idx = st.session_state.eval_idx
 responses = st.session_state.responses
@@ -355,9 +358,10 @@ st.info(
 )
 st.markdown("---")
 
-# Ottieni le sezioni per entrambe le risposte
-sections_A = split_sections(responses[0]["content"])
-sections_B = split_sections(responses[1]["content"])
+# Ottieni le sezioni per entrambe le risposte, già convertite in HTML (una volta per versione del corpus)
+sections_A = get_sections_html(responses[0]["agent"], idx, corpus_version())
+sections_B = get_sections_html(responses[1]["agent"], idx, corpus_version())
+st.html(SECTION_CSS)
 
 # Inizializza gli slider se non esistono
 slider_keys = [
@@ -376,10 +380,10 @@ def render_relevance_sliders():
     col1, col2, col3 = st.columns([8, 1, 8])
     
     with col1:
-        rel_A = st.slider("Response A - Relevance", 0, 10, key="rel_A", help="0 = Not selected, 1-10 = Rating scale")
+        rel_A = st.slider("Response A - Relevance", 0, 10, key="rel_A", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("relevance",))
     
     with col3:
-        rel_B = st.slider("Response B - Relevance", 0, 10, key="rel_B", help="0 = Not selected, 1-10 = Rating scale")
+        rel_B = st.slider("Response B - Relevance", 0, 10, key="rel_B", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("relevance",))
     
     return rel_A, rel_B
 
@@ -389,10 +393,10 @@ def render_credibility_sliders():
     col1, col2, col3 = st.columns([8, 1, 8])
     
     with col1:
-        cred_A = st.slider("Response A - Credibility", 0, 10, key="cred_A", help="0 = Not selected, 1-10 = Rating scale")
+        cred_A = st.slider("Response A - Credibility", 0, 10, key="cred_A", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("credibility",))
     
     with col3:
-        cred_B = st.slider("Response B - Credibility", 0, 10, key="cred_B", help="0 = Not selected, 1-10 = Rating scale")
+        cred_B = st.slider("Response B - Credibility", 0, 10, key="cred_B", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("credibility",))
     
     return cred_A, cred_B
 
@@ -402,10 +406,10 @@ def render_uncertainty_sliders():
     col1, col2, col3 = st.columns([8, 1, 8])
     
     with col1:
-        uncer_A = st.slider("Response A - Uncertainty", 0, 10, key="uncer_A", help="0 = Not selected, 1-10 = Rating scale")
+        uncer_A = st.slider("Response A - Uncertainty", 0, 10, key="uncer_A", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("uncertainty",))
     
     with col3:
-        uncer_B = st.slider("Response B - Uncertainty", 0, 10, key="uncer_B", help="0 = Not selected, 1-10 = Rating scale")
+        uncer_B = st.slider("Response B - Uncertainty", 0, 10, key="uncer_B", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("uncertainty",))
     
     return uncer_A, uncer_B
 
@@ -415,10 +419,10 @@ def render_actionability_sliders():
     col1, col2, col3 = st.columns([8, 1, 8])
     
     with col1:
-        action_A = st.slider("Response A - Actionability", 0, 10, key="action_A", help="0 = Not selected, 1-10 = Rating scale")
+        action_A = st.slider("Response A - Actionability", 0, 10, key="action_A", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("actionability",))
     
     with col3:
-        action_B = st.slider("Response B - Actionability", 0, 10, key="action_B", help="0 = Not selected, 1-10 = Rating scale")
+        action_B = st.slider("Response B - Actionability", 0, 10, key="action_B", help="0 = Not selected, 1-10 = Rating scale", on_change=mark_section, args=("actionability",))
     
     return action_A, action_B
 
@@ -441,13 +445,13 @@ with col1:
     st.markdown("#### Response A")
     with st.container(border=True):
         st.markdown("##### Executive Summary")
-        st.markdown(sections_A.get("Executive summary", "*No summary found.*"))
+        st.html(sections_A.get("Executive summary") or render_markdown("*No summary found.*"))
 
 with col3:
     st.markdown("#### Response B") 
     with st.container(border=True):
         st.markdown("##### Executive Summary")
-        st.markdown(sections_B.get("Executive summary", "*No summary found.*"))
+        st.html(sections_B.get("Executive summary") or render_markdown("*No summary found.*"))
 
 # Valutazioni Relevance
 rel_A, rel_B = render_relevance_sliders()
@@ -473,13 +477,13 @@ with col1:
     st.markdown("#### Response A")
     with st.container(border=True):
         st.markdown("##### Credibility")
-        st.markdown(sections_A.get("Credibility", "*No credibility section found.*"))
+        st.html(sections_A.get("Credibility") or render_markdown("*No credibility section found.*"))
 
 with col3:
     st.markdown("#### Response B")
     with st.container(border=True):
         st.markdown("##### Credibility")  
-        st.markdown(sections_B.get("Credibility", "*No credibility section found.*"))
+        st.html(sections_B.get("Credibility") or render_markdown("*No credibility section found.*"))
 
 # Valutazioni Credibility
 cred_A, cred_B = render_credibility_sliders()
@@ -505,13 +509,13 @@ with col1:
     st.markdown("#### Response A")
     with st.container(border=True):
         st.markdown("##### Uncertainty")
-        st.markdown(sections_A.get("Uncertainty", "*No uncertainty section found.*"))
+        st.html(sections_A.get("Uncertainty") or render_markdown("*No uncertainty section found.*"))
 
 with col3:
     st.markdown("#### Response B")
     with st.container(border=True):
         st.markdown("##### Uncertainty")
-        st.markdown(sections_B.get("Uncertainty", "*No uncertainty section found.*"))
+        st.html(sections_B.get("Uncertainty") or render_markdown("*No uncertainty section found.*"))
 
 # Valutazioni Uncertainty
 uncer_A, uncer_B = render_uncertainty_sliders()
@@ -537,13 +541,13 @@ with col1:
     st.markdown("#### Response A")
     with st.container(border=True):
         st.markdown("##### Actionability")
-        st.markdown(sections_A.get("Actionability", "*No actionability section found.*"))
+        st.html(sections_A.get("Actionability") or render_markdown("*No actionability section found.*"))
 
 with col3:
     st.markdown("#### Response B")
     with st.container(border=True):
         st.markdown("##### Actionability")
-        st.markdown(sections_B.get("Actionability", "*No actionability section found.*"))
+        st.html(sections_B.get("Actionability") or render_markdown("*No actionability section found.*"))
 
 # Valutazioni Actionability
 action_A, action_B = render_actionability_sliders()
@@ -558,12 +562,13 @@ with col2:
     if st.button("✅ Send Evaluation", type="primary", use_container_width=True):
         # Verifica che tutti i valori siano diversi da 0
         if all([rel_A > 0, cred_A > 0, uncer_A > 0, action_A > 0, rel_B > 0, cred_B > 0, uncer_B > 0, action_B > 0]):
-            save_evaluation(st.session_state.user_id, response_id, responses[0]['agent'], rel_A, cred_A, uncer_A, action_A)
-            save_evaluation(st.session_state.user_id, response_id, responses[1]['agent'], rel_B, cred_B, uncer_B, action_B)
+            timing = evaluation_timing(datetime.now(timezone.utc))
+            save_evaluation(st.session_state.user_id, response_id, responses[0]['agent'], rel_A, cred_A, uncer_A, action_A, timing)
+            save_evaluation(st.session_state.user_id, response_id, responses[1]['agent'], rel_B, cred_B, uncer_B, action_B, timing)
             st.success(f"✅ Evaluations for question {response_id} saved!")
 
             # Rimuovi le chiavi della sessione per generare nuova domanda e resettare slider
-            for k in ["eval_idx", "responses"] + slider_keys:
+            for k in ["eval_idx", "responses", "shown_at", "section_rated_at"] + slider_keys:
                 if k in st.session_state:
                     del st.session_state[k]
 
@@ -4,14 +4,23 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import gspread
-from google.oauth2.service_account import Credentials
 import os
 import glob
 from scipy.stats import pearsonr, spearmanr
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sklearn.linear_model import LinearRegression
 
+from utils.corpus import AGENTS, BASELINE_AGENT, corpus_version, load_corpus_table
+from utils.evaluation_store import TIMING_COLUMNS, get_evaluation_store, get_user_store, sync_stores
+from utils.derived_cache import cached_aggregate, cached_figure
+from utils.geo import hexbin_scores
+from utils.rendering import SECTION_CSS, get_sections_html
+from utils.search import SEARCH_FIELDS, SECTION_FIELDS, load_search_index
+from utils.similarity import SIMILARITY_THRESHOLD, load_pair_similarity, similarity_to
+from utils.text_features import BIAS_FEATURES, CRITERION_SECTIONS, FULL_RESPONSE, load_text_features, partial_correlations
+from utils.shared_cache import frame_version
+from utils.sheets import get_gateway
+
 # Set page config
 st.set_page_config(layout="wide", page_title="Statistics - AI Climate Evaluation")
 
@@ -69,174 +78,116 @@ if not check_password():
     st.stop()
 
 # === Setup Google Sheets ===
-@st.cache_resource
-def init_gsheets():
-    scope = ["https://www.googleapis.com/auth/spreadsheets"]
-    credentials = Credentials.from_service_account_info(st.secrets["gspread"], scopes=scope)
-    gc = gspread.authorize(credentials)
-    sh = gc.open_by_url(st.secrets["gspread"]["sheet_url"])
-    return sh
-
-@st.cache_data(ttl=300)  # Cache per 5 minuti
-def load_evaluation_data():
-    """Carica tutti i dati di valutazione dal Google Sheet"""
-    sh = init_gsheets()
-    eval_ws = sh.worksheet("evaluations")
-    return pd.DataFrame(eval_ws.get_all_records())
-
-@st.cache_data(ttl=300)
-def load_user_data():
-    """Carica i dati degli utenti dal Google Sheet"""
-    sh = init_gsheets()
-    user_ws = sh.worksheet("users")
-    return pd.DataFrame(user_ws.get_all_records())
-
-# === Main UI ===
-st.title("📊 Evaluation Statistics")
-st.success("✅ Authenticated successfully")
+def load_data():
+    """Valutazioni e utenti dagli store in memoria: le righe di questo processo sono già
+    presenti, dal Google Sheet si leggono solo quelle scritte da altre repliche, per
+    entrambi i fogli con un'unica lettura batch. Dopo un riavvio si parte dall'ultimo
+    snapshot su disco e si aggiorna in background."""
+    eval_store, user_store = get_evaluation_store(), get_user_store()
+    sync_stores([eval_store, user_store], background=True)
+    return eval_store.to_frame(), user_store.to_frame()
 
-# Logout button
-if st.button("🚪 Logout"):
+def logout():
     st.session_state["password_correct"] = False
-    st.rerun()
 
-st.markdown("---")
+numeric_cols = ['relevance', 'credibility', 'uncertainty', 'actionability']
+categories = ['Relevance', 'Credibility', 'Uncertainty', 'Actionability']
 
-# Carica i dati
-try:
-    eval_df = load_evaluation_data()
-    user_df = load_user_data()
-    
-    if eval_df.empty:
-        st.info("No evaluation data available yet.")
-        st.stop()
-    
-    # Converte le colonne numeriche per dati umani
-    numeric_cols = ['relevance', 'credibility', 'uncertainty', 'actionability']
-    for col in numeric_cols:
-        if col in eval_df.columns:
-            eval_df[col] = pd.to_numeric(eval_df[col], errors='coerce')
-    
-    # === Metriche generali ===
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.metric("Total Evaluations", len(eval_df))
-    
-    with col2:
-        unique_users = eval_df['user_id'].nunique()
-        st.metric("Active Evaluators", unique_users)
-    
-    with col3:
-        unique_questions = eval_df['question_id'].nunique()
-        st.metric("Questions Evaluated", unique_questions)
-    
-    with col4:
-        unique_agents = eval_df['agent'].nunique()
-        st.metric("AI Agents Compared", unique_agents)
-    
-    st.markdown("---")
-    
-    # === Analisi per Agent ===
+# === Sezioni della dashboard ===
+# Ogni sezione è un fragment calcolato solo quando la sua scheda è aperta;
+# i widget interni rieseguono solo il fragment, non l'intera pagina.
+
+@st.fragment
+def agents_section(eval_df, data_version):
     st.header("🤖 Performance by AI Agent")
     
-    # Calcola medie per agent
-    agent_stats = eval_df.groupby('agent')[numeric_cols].agg(['mean', 'std', 'count']).round(2)
+    def compute_agent_means():
+        return eval_df.groupby('agent', observed=True)[numeric_cols].mean()
+    agent_means = cached_aggregate("agent_means", data_version, compute_agent_means)
     
     # Grafico a radar per confronto agent
-    fig_radar = go.Figure()
-    
-    agents = eval_df['agent'].unique()
-    categories = ['Relevance', 'Credibility', 'Uncertainty', 'Actionability']
-    
-    for agent in agents:
-        agent_data = eval_df[eval_df['agent'] == agent]
-        values = [agent_data[col].mean() for col in numeric_cols]
+    def build_radar():
+        fig_radar = go.Figure()
         
-        fig_radar.add_trace(go.Scatterpolar(
-            r=values,
-            theta=categories,
-            fill='toself',
-            name=agent,
-            line_color=px.colors.qualitative.Set1[list(agents).index(agent) % len(px.colors.qualitative.Set1)]
-        ))
-    
-    fig_radar.update_layout(
-        polar=dict(
-            radialaxis=dict(
-                visible=True,
-                range=[0, 10]  # Cambiato per la nuova scala 1-10
-            )),
-        showlegend=True,
-        title="Average Scores by AI Agent",
-        height=500
-    )
-    
-    col1, col2 = st.columns([2, 1])
-    
-    with col1:
-        st.plotly_chart(fig_radar, use_container_width=True)
-    
-    with col2:
-        st.subheader("Summary Table")
-        # Tabella riassuntiva
-        summary_table = eval_df.groupby('agent')[numeric_cols].mean().round(2)
-        summary_table['Count'] = eval_df.groupby('agent').size()
-        st.dataframe(summary_table, use_container_width=True)
-    
-    st.markdown("---")
+        agents = list(agent_means.index)
+        for agent in agents:
+            fig_radar.add_trace(go.Scatterpolar(
+                r=agent_means.loc[agent].tolist(),
+                theta=categories,
+                fill='toself',
+                name=agent,
+                line_color=px.colors.qualitative.Set1[agents.index(agent) % len(px.colors.qualitative.Set1)]
+            ))
+        
+        fig_radar.update_layout(
+            polar=dict(
+                radialaxis=dict(
+                    visible=True,
+                    range=[0, 10]  # Cambiato per la nuova scala 1-10
+                )),
+            showlegend=True,
+            title="Average Scores by AI Agent",
+            height=500
+        )
+        return fig_radar
     
-    # === Distribuzione dei punteggi ===
+    st.plotly_chart(cached_figure("radar", build_radar, agent_means), use_container_width=True)
+
+@st.fragment
+def distribution_section(eval_df, data_version):
     st.header("📈 Score Distribution")
     
     # Box plot per ogni criterio
-    fig_box = make_subplots(
-        rows=2, cols=2,
-        subplot_titles=("Relevance", "Credibility", "Uncertainty", "Actionability")
-    )
-    
-    positions = [(1, 1), (1, 2), (2, 1), (2, 2)]
-    
-    for i, col in enumerate(numeric_cols):
-        row, col_pos = positions[i]
-        for agent in agents:
-            agent_data = eval_df[eval_df['agent'] == agent][col].dropna()
-            fig_box.add_trace(
-                go.Box(y=agent_data, name=agent, showlegend=(i == 0)),
-                row=row, col=col_pos
-            )
-    
-    fig_box.update_layout(height=600, title_text="Score Distribution by Criterion and Agent")
-    st.plotly_chart(fig_box, use_container_width=True)
-    
-    st.markdown("---")
+    def build_box():
+        fig_box = make_subplots(
+            rows=2, cols=2,
+            subplot_titles=("Relevance", "Credibility", "Uncertainty", "Actionability")
+        )
+        
+        positions = [(1, 1), (1, 2), (2, 1), (2, 2)]
+        agents = eval_df['agent'].unique()
+        
+        for i, col in enumerate(numeric_cols):
+            row, col_pos = positions[i]
+            for agent in agents:
+                agent_data = eval_df[eval_df['agent'] == agent][col].dropna()
+                fig_box.add_trace(
+                    go.Box(y=agent_data, name=agent, showlegend=(i == 0)),
+                    row=row, col=col_pos
+                )
+        
+        fig_box.update_layout(height=600, title_text="Score Distribution by Criterion and Agent")
+        return fig_box
     
-    # === Analisi degli utenti ===
+    st.plotly_chart(cached_figure("score_box", build_box, data_version), use_container_width=True)
+
+@st.fragment
+def evaluators_section(eval_df, user_df, data_version):
     st.header("👥 Evaluator Analysis")
     
     col1, col2 = st.columns(2)
     
     with col1:
         # Distribuzione valutazioni per utente
-        user_counts = eval_df['user_id'].value_counts().head(10)
-        fig_users = px.bar(
+        user_counts = cached_aggregate("user_counts", data_version, lambda: eval_df['user_id'].value_counts().head(10))
+        fig_users = cached_figure("top_users", lambda: px.bar(
             x=user_counts.values,
             y=user_counts.index,
             orientation='h',
             title="Top 10 Most Active Evaluators",
             labels={'x': 'Number of Evaluations', 'y': 'User ID'}
-        )
+        ), user_counts)
         st.plotly_chart(fig_users, use_container_width=True)
     
     with col2:
         # Distribuzione per ruolo (se disponibile)
         if not user_df.empty and 'role' in user_df.columns:
             role_counts = user_df['role'].value_counts()
-            fig_roles = px.pie(
+            fig_roles = cached_figure("roles", lambda: px.pie(
                 values=role_counts.values,
                 names=role_counts.index,
                 title="Evaluators by Role"
-            )
+            ), role_counts)
             st.plotly_chart(fig_roles, use_container_width=True)
     
     # === Analisi per istituto ===
@@ -249,84 +200,477 @@ try:
             # Top istituzioni per numero di valutatori
             institution_user_counts = user_df['institution'].value_counts().head(10)
             if not institution_user_counts.empty:
-                fig_inst_users = px.bar(
+                fig_inst_users = cached_figure("institution_users", lambda: px.bar(
                     x=institution_user_counts.values,
                     y=institution_user_counts.index,
                     orientation='h',
                     title="Top 10 Institutions by Number of Evaluators",
                     labels={'x': 'Number of Evaluators', 'y': 'Institution'}
-                )
+                ), institution_user_counts)
                 st.plotly_chart(fig_inst_users, use_container_width=True)
         
         with col2:
-            # Merge user data with evaluation data per analizzare valutazioni per istituto
+            # Valutazioni per istituto: il merge con gli utenti dipende anche dalla versione del foglio utenti
             if 'user_id' in eval_df.columns and 'user_id' in user_df.columns:
-                eval_with_inst = eval_df.merge(user_df[['user_id', 'institution']], on='user_id', how='left')
-                
-                if 'institution' in eval_with_inst.columns:
-                    institution_eval_counts = eval_with_inst['institution'].value_counts().head(10)
-                    if not institution_eval_counts.empty:
-                        fig_inst_evals = px.bar(
-                            x=institution_eval_counts.values,
-                            y=institution_eval_counts.index,
-                            orientation='h',
-                            title="Top 10 Institutions by Number of Evaluations",
-                            labels={'x': 'Number of Evaluations', 'y': 'Institution'}
-                        )
-                        st.plotly_chart(fig_inst_evals, use_container_width=True)
-    
-    st.markdown("---")
-    
-    # === Matrice di correlazione ===
+                def compute_institution_evals():
+                    eval_with_inst = eval_df.merge(user_df[['user_id', 'institution']], on='user_id', how='left')
+                    return eval_with_inst['institution'].value_counts().head(10)
+                institution_eval_counts = cached_aggregate(
+                    f"institution_evals:{frame_version(user_df)}", data_version, compute_institution_evals
+                )
+                if not institution_eval_counts.empty:
+                    fig_inst_evals = cached_figure("institution_evals", lambda: px.bar(
+                        x=institution_eval_counts.values,
+                        y=institution_eval_counts.index,
+                        orientation='h',
+                        title="Top 10 Institutions by Number of Evaluations",
+                        labels={'x': 'Number of Evaluations', 'y': 'Institution'}
+                    ), institution_eval_counts)
+                    st.plotly_chart(fig_inst_evals, use_container_width=True)
+
+@st.fragment
+def correlation_section(eval_df, data_version):
     st.header("🔗 Correlation Analysis")
     
     # Calcola correlazioni tra i criteri
-    corr_matrix = eval_df[numeric_cols].corr()
+    corr_matrix = cached_aggregate("corr_matrix", data_version, lambda: eval_df[numeric_cols].corr())
     
-    fig_corr = px.imshow(
+    fig_corr = cached_figure("corr_matrix", lambda: px.imshow(
         corr_matrix,
         text_auto=True,
         aspect="auto",
         title="Correlation Matrix between Evaluation Criteria",
         color_continuous_scale="RdBu_r"
-    )
+    ), corr_matrix)
     
     st.plotly_chart(fig_corr, use_container_width=True)
+
+@st.fragment
+def length_bias_section(eval_df, data_version):
+    st.header("📏 Length Bias Analysis")
+    st.markdown("*Partial correlation between text features of the rated response and its score, controlling for the other features*")
     
-    st.markdown("---")
+    text_features = load_text_features(corpus_version())
     
-    # === Analisi temporale (se disponibile timestamp) ===
-    if 'timestamp' in eval_df.columns:
-        st.header("⏰ Temporal Analysis")
-        
-        eval_df['timestamp'] = pd.to_datetime(eval_df['timestamp'])
-        daily_counts = eval_df.groupby(eval_df['timestamp'].dt.date).size()
-        
-        fig_temporal = px.line(
-            x=daily_counts.index,
-            y=daily_counts.values,
-            title="Daily Evaluation Activity",
-            labels={'x': 'Date', 'y': 'Number of Evaluations'}
-        )
-        
-        st.plotly_chart(fig_temporal, use_container_width=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        bias_agent = st.selectbox("Agent", ["All agents"] + sorted(eval_df['agent'].unique()), key="bias_agent")
+    with col2:
+        criterion_scope = "Section shown for the criterion"
+        bias_scope = st.radio("Text features of", [criterion_scope, FULL_RESPONSE], horizontal=True, key="bias_scope")
+    
+    def compute_partial_correlations():
+        rated = eval_df if bias_agent == "All agents" else eval_df[eval_df['agent'] == bias_agent]
+        result = {}
+        for col, category in zip(numeric_cols, categories):
+            section = CRITERION_SECTIONS[col] if bias_scope == criterion_scope else FULL_RESPONSE
+            features = text_features[text_features['section'] == section].drop(columns='section')
+            features = features.astype({'question_id': str, 'agent': str})
+            merged = rated[['question_id', 'agent', col]].merge(features, on=['question_id', 'agent'])
+            result[category] = partial_correlations(merged, BIAS_FEATURES, col)
+        return pd.DataFrame(result)
+    
+    partial_corr = cached_aggregate(f"partial_corr:{bias_agent}:{bias_scope}", data_version, compute_partial_correlations)
+    partial_corr = partial_corr.set_axis(['Word count', 'Table rows', 'Recommendations', 'Numbers per 100 words'])
+    
+    fig_bias = cached_figure("partial_corr", lambda: px.imshow(
+        partial_corr.round(2),
+        text_auto=True,
+        aspect="auto",
+        zmin=-1, zmax=1,
+        title=f"Partial Correlation between Text Features and Scores ({bias_agent})",
+        color_continuous_scale="RdBu_r"
+    ), partial_corr, bias_agent)
+    st.plotly_chart(fig_bias, use_container_width=True)
+    st.caption("A clearly positive word-count value means longer answers get higher scores regardless of their structure and content density.")
+
+@st.fragment
+def similarity_section(eval_df, data_version):
+    st.header("🧬 Response Similarity")
+    st.markdown(f"*TF-IDF cosine similarity between each rated response and the {BASELINE_AGENT} answer it was paired with*")
+    
+    def compute_rated_pairs():
+        baseline_similarity = similarity_to(load_pair_similarity(corpus_version()), BASELINE_AGENT)
+        rated_pairs = eval_df.loc[eval_df['agent'] != BASELINE_AGENT, ['question_id', 'agent']].copy()
+        rated_pairs['similarity'] = baseline_similarity.reindex(
+            pd.MultiIndex.from_frame(rated_pairs[['question_id', 'agent']])
+        ).to_numpy()
+        return rated_pairs.dropna(subset=['similarity'])
+    rated_pairs = cached_aggregate(f"rated_pairs:{corpus_version()}", data_version, compute_rated_pairs)
+    
+    if not rated_pairs.empty:
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            def build_similarity():
+                fig_similarity = px.histogram(
+                    rated_pairs, x='similarity', color='agent', nbins=30, barmode='overlay',
+                    title=f"Similarity of Rated Pairs to {BASELINE_AGENT}",
+                    labels={'similarity': 'Cosine similarity', 'agent': 'Agent'}
+                )
+                fig_similarity.add_vline(x=SIMILARITY_THRESHOLD, line_dash="dash", annotation_text="near-duplicate")
+                return fig_similarity
+            fig_similarity = cached_figure("pair_similarity", build_similarity, data_version, corpus_version(), SIMILARITY_THRESHOLD)
+            st.plotly_chart(fig_similarity, use_container_width=True)
+        with col2:
+            st.metric("Median pair similarity", f"{rated_pairs['similarity'].median():.2f}")
+            st.metric("Near-duplicate pairs rated", int((rated_pairs['similarity'] >= SIMILARITY_THRESHOLD).sum()),
+                      help=f"Pairs with similarity ≥ {SIMILARITY_THRESHOLD}; new pairs above this threshold are no longer served")
+            st.subheader("Most similar rated pairs")
+            st.dataframe(
+                rated_pairs.groupby(['question_id', 'agent'], observed=True)['similarity'].first()
+                .sort_values(ascending=False).head(10).round(3).reset_index(),
+                use_container_width=True, hide_index=True
+            )
+
+@st.fragment
+def spatial_section(eval_df, data_version):
+    st.header("🗺️ Spatial Analysis")
+    st.markdown("*Mean scores aggregated over hexagonal areas around the question locations*")
     
-    # === Sezione dati raw (opzionale) ===
-    with st.expander("🔍 Raw Data Preview"):
-        st.subheader("Recent Evaluations")
-        st.dataframe(eval_df.head(20), use_container_width=True)
-        
-        st.subheader("Download Data")
-        csv = eval_df.to_csv(index=False)
-        st.download_button(
-            label="Download evaluation data as CSV",
-            data=csv,
-            file_name="evaluation_data.csv",
-            mime="text/csv"
+    questions = load_corpus_table(corpus_version())
+    questions = questions[questions['agent'] == BASELINE_AGENT].set_index('question_id')
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        map_criterion = st.selectbox("Criterion", ["Overall"] + categories, key="map_criterion")
+    with col2:
+        advantage_label = f"Climate-data agents vs {BASELINE_AGENT}"
+        map_view = st.selectbox("Show", [advantage_label] + sorted(eval_df['agent'].unique()), key="map_view")
+    with col3:
+        hex_size = st.select_slider("Hexagon size (degrees)", [1, 2, 5, 10, 20], value=5, key="map_hex_size")
+    
+    def compute_hexbins():
+        # Un solo passaggio vettorizzato: bin per (esagono, agent) e per (esagono, baseline sì/no)
+        scores = eval_df[numeric_cols].set_axis(categories, axis=1)
+        scores['Overall'] = scores.mean(axis=1)
+        lat = eval_df['question_id'].map(questions['lat'])
+        lon = eval_df['question_id'].map(questions['lon'])
+        agent_codes = eval_df['agent'].astype('category')
+        by_agent = hexbin_scores(lat, lon, agent_codes.cat.codes, scores, hex_size)
+        by_agent['agent'] = np.asarray(agent_codes.cat.categories)[by_agent['group']]
+        by_baseline = hexbin_scores(lat, lon, (eval_df['agent'] == BASELINE_AGENT).astype(int), scores, hex_size)
+        return by_agent, by_baseline
+    
+    hex_by_agent, hex_by_baseline = cached_aggregate(f"hexbins:{hex_size}", data_version, compute_hexbins)
+    
+    if map_view == advantage_label:
+        # Differenza di punteggio medio (agent con dati climatici - Plain-LLM) negli esagoni con entrambi
+        baseline_bins = hex_by_baseline[hex_by_baseline['group'] == 1].set_index(['q', 'r'])
+        others_bins = hex_by_baseline[hex_by_baseline['group'] == 0].set_index(['q', 'r'])
+        map_df = others_bins.join(baseline_bins[[map_criterion, 'count']], rsuffix='_baseline', how='inner').reset_index()
+        map_df['Advantage'] = map_df[map_criterion] - map_df[f'{map_criterion}_baseline']
+        map_df['Ratings'] = map_df['count'] + map_df['count_baseline']
+        limit = max(map_df['Advantage'].abs().max(), 0.5) if not map_df.empty else 1
+        build_map = lambda: px.scatter_geo(
+            map_df, lat='center_lat', lon='center_lon', color='Advantage', size='Ratings',
+            hover_data={map_criterion: ':.2f', f'{map_criterion}_baseline': ':.2f', 'center_lat': False, 'center_lon': False},
+            color_continuous_scale="RdBu", range_color=[-limit, limit],
+            title=f"{map_criterion}: climate-data agents minus {BASELINE_AGENT} (blue = climate-data agents better)"
+        )
+    else:
+        map_df = hex_by_agent[hex_by_agent['agent'] == map_view].rename(columns={'count': 'Ratings'})
+        build_map = lambda: px.scatter_geo(
+            map_df, lat='center_lat', lon='center_lon', color=map_criterion, size='Ratings',
+            hover_data={'center_lat': False, 'center_lon': False},
+            color_continuous_scale="Viridis", range_color=[1, 10],
+            title=f"{map_criterion}: mean score of {map_view}"
         )
+    
+    def build_hex_map():
+        fig_map = build_map()
+        fig_map.update_traces(marker_symbol='hexagon')
+        fig_map.update_layout(height=550, geo=dict(showcountries=True, projection_type='natural earth'))
+        return fig_map
+    fig_map = cached_figure("hex_map", build_hex_map, map_df, map_criterion, map_view)
+    st.plotly_chart(fig_map, use_container_width=True)
+    st.caption(f"{len(map_df)} areas shown, each summarising all ratings of the questions located inside it")
+
+@st.fragment
+def temporal_section(eval_df, data_version):
+    # Timestamp e tempi sono già tipizzati dallo store: restano le righe con i tempi registrati
+    timed_df = cached_aggregate("timed_evaluations", data_version, lambda: eval_df.dropna(subset=['timestamp']))
+    
+    if timed_df.empty:
+        st.info("No evaluations with recorded timestamps yet.")
+        return
+    
+    st.header("⏰ Temporal Analysis")
+    
+    daily_counts = timed_df.groupby(timed_df['timestamp'].dt.date).size()
+    
+    fig_temporal = cached_figure("daily_activity", lambda: px.line(
+        x=daily_counts.index,
+        y=daily_counts.values,
+        title="Daily Evaluation Activity",
+        labels={'x': 'Date', 'y': 'Number of Evaluations'}
+    ), daily_counts)
+    
+    st.plotly_chart(fig_temporal, use_container_width=True)
+    
+    # === Throughput dei valutatori ===
+    st.subheader("⚡ Rater Throughput")
+    
+    # Una riga per coppia inviata: i tempi sono registrati per coppia (risposta A e B)
+    pairs = timed_df.drop_duplicates(['user_id', 'question_id', 'timestamp'])
+    rater_time = pairs.groupby('user_id', observed=True)['dwell_seconds'].sum() / 3600
+    rater_evals = timed_df.groupby('user_id', observed=True).size()
+    rater_throughput = (rater_evals / rater_time[rater_time > 0]).dropna()
+    rushed_seconds = 60
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        last_day = timed_df[timed_df['timestamp'] >= timed_df['timestamp'].max() - pd.Timedelta(hours=24)]
+        st.metric("Evaluations/hour (last 24h)", f"{len(last_day) / 24:.1f}")
+    with col2:
+        st.metric("Median rater throughput", f"{rater_throughput.median():.1f} evals/h" if not rater_throughput.empty else "–",
+                  help="Evaluations per hour of time spent on the evaluation page")
+    with col3:
+        st.metric("Rushed pairs", f"{(pairs['dwell_seconds'] < rushed_seconds).mean():.0%}",
+                  help=f"Pairs submitted less than {rushed_seconds} seconds after being shown")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        hourly_counts = timed_df.set_index('timestamp').resample('h').size()
+        fig_hourly = cached_figure("hourly_activity", lambda: px.bar(
+            x=hourly_counts.index,
+            y=hourly_counts.values,
+            title="Evaluations per Hour",
+            labels={'x': 'Hour (UTC)', 'y': 'Number of Evaluations'}
+        ), hourly_counts)
+        st.plotly_chart(fig_hourly, use_container_width=True)
+    with col2:
+        fig_throughput = cached_figure("rater_throughput", lambda: px.histogram(
+            x=rater_throughput.values,
+            nbins=20,
+            title="Rater Throughput Distribution",
+            labels={'x': 'Evaluations per hour', 'y': 'Raters'}
+        ), rater_throughput)
+        st.plotly_chart(fig_throughput, use_container_width=True)
+    
+    # === Tempi di permanenza ===
+    st.subheader("⏱️ Dwell Time")
+    st.markdown(f"*One value per pair, grouped by the agent that was paired with {BASELINE_AGENT}*")
+    
+    # Le due righe di una coppia hanno gli stessi tempi: si tiene quella dell'agent alternativo
+    paired_df = cached_aggregate("dwell_pairs", data_version, lambda: (
+        timed_df[timed_df['agent'] != BASELINE_AGENT]
+        .drop_duplicates(['user_id', 'question_id', 'timestamp'])
+        .assign(agent=lambda df: df['agent'].cat.remove_unused_categories())
+    ))
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_dwell = cached_figure("dwell_by_paired_agent", lambda: px.box(
+            paired_df, x='agent', y='dwell_seconds', points=False,
+            title=f"Time per Pair by Agent Paired with {BASELINE_AGENT}",
+            labels={'agent': 'Paired agent', 'dwell_seconds': 'Seconds from display to submit'}
+        ), data_version)
+        st.plotly_chart(fig_dwell, use_container_width=True)
+    with col2:
+        def build_section_dwell():
+            section_dwell = paired_df.melt(
+                id_vars='agent', value_vars=TIMING_COLUMNS[1:], var_name='section', value_name='seconds'
+            )
+            section_dwell['section'] = section_dwell['section'].str.replace('_seconds', '').str.capitalize()
+            return px.box(
+                section_dwell, x='section', y='seconds', color='agent', points=False,
+                title=f"Time per Section by Agent Paired with {BASELINE_AGENT}",
+                labels={'section': 'Section', 'seconds': 'Seconds before the first rating', 'agent': 'Paired agent'}
+            )
+        fig_section_dwell = cached_figure("dwell_by_paired_section", build_section_dwell, data_version)
+        st.plotly_chart(fig_section_dwell, use_container_width=True)
+
+@st.fragment
+def search_section(eval_df, data_version):
+    st.header("🔎 Search Responses")
+    st.markdown("*Find questions by id, text, theme, category or response content, and compare how each agent was rated*")
+    
+    version = corpus_version()
+    index = load_search_index(version)
+    
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        query = st.text_input("Search", key="search_query", placeholder="e.g. Q127, olive groves, drought uncertainty")
+    with col2:
+        search_fields = st.multiselect("In", SEARCH_FIELDS, key="search_fields", placeholder="All fields")
+    
+    if not query:
+        return
+    
+    results = index.search(query, fields=search_fields)
+    st.caption(f"{len(results)} matching questions")
+    if results.empty:
+        return
+    
+    # Punteggio medio (media dei quattro criteri) per domanda e agent
+    def compute_question_scores():
+        overall = eval_df[numeric_cols].mean(axis=1)
+        return overall.groupby([eval_df['question_id'], eval_df['agent']], observed=True).mean().unstack('agent').round(2)
+    question_scores = cached_aggregate("question_scores", data_version, compute_question_scores)
+    
+    questions = load_corpus_table(version)
+    questions = questions[questions['agent'] == BASELINE_AGENT].set_index('question_id')
+    
+    table = results.join(questions[['question_text', 'theme']], on='question_id')
+    table = table.join(question_scores, on='question_id')
+    st.dataframe(table, use_container_width=True, hide_index=True)
+    
+    # === Dettaglio di una domanda ===
+    question_id = st.selectbox("Drill down", results['question_id'], key="search_question")
+    question = questions.loc[question_id]
+    st.subheader(f"{question_id} · {question['theme']} · {question['category']}")
+    st.markdown(f"> {question['question_text']}")
+    
+    rated = eval_df[eval_df['question_id'] == question_id]
+    if rated.empty:
+        st.info("This question has not been rated yet.")
+    else:
+        detail = rated.groupby('agent', observed=True)[numeric_cols].mean().round(2).set_axis(categories, axis=1)
+        detail['Ratings'] = rated.groupby('agent', observed=True).size()
+        st.dataframe(detail, use_container_width=True)
+    
+    # Sezioni delle risposte che contengono i termini; se la domanda corrisponde solo
+    # per id, testo, tema o categoria si mostrano le risposte complete
+    matched = [(agent, field) for agent, field in index.matching_fields(query, question_id, fields=search_fields) if agent]
+    if not matched:
+        matched = [(agent, field) for agent in AGENTS for field in SECTION_FIELDS]
+    st.html(SECTION_CSS)
+    idx = question_id[1:]
+    for agent in [agent for agent in AGENTS if any(a == agent for a, _ in matched)]:
+        sections_html = get_sections_html(agent, idx, version)
+        with st.expander(f"{agent} — {', '.join(field for a, field in matched if a == agent)}"):
+            for field in [field for a, field in matched if a == agent]:
+                st.markdown(f"**{field}**")
+                st.html(sections_html.get(field) or "<em>Section not found.</em>")
+
+def raw_data_section(eval_df):
+    st.subheader("Recent Evaluations")
+    st.dataframe(eval_df.head(20), use_container_width=True)
+    
+    st.subheader("Download Data")
+    csv = eval_df.to_csv(index=False)
+    st.download_button(
+        label="Download evaluation data as CSV",
+        data=csv,
+        file_name="evaluation_data.csv",
+        mime="text/csv"
+    )
+
+@st.fragment
+def quota_section():
+    quota = get_gateway().quota_status()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Read headroom", f"{quota['read_headroom']:.0%}", help=f"{quota['read_available']} / {quota['read_limit']} requests available in the last minute")
+    col2.metric("Write headroom", f"{quota['write_headroom']:.0%}", help=f"{quota['write_available']} / {quota['write_limit']} requests available in the last minute")
+    col3.metric("Coalesced reads", quota['coalesced'], help="Identical in-flight reads served by a single API call")
+    col4.metric("Throttled (429)", quota['throttled'], help=f"{quota['retries']} retries, {quota['failures']} failures")
+    st.caption(
+        f"{quota['reads']} reads and {quota['writes']} writes since start, "
+        f"{quota['shared_hits']} reads served by the shared cache, "
+        f"{quota['wait_seconds']:.1f}s spent waiting on the rate limiter"
+    )
+    st.button("🔄 Refresh quota")
+
+# === Main UI ===
+st.title("📊 Evaluation Statistics")
+st.success("✅ Authenticated successfully")
+
+# Logout: il callback evita di calcolare la dashboard solo per poi uscire
+st.button("🚪 Logout", on_click=logout)
+
+st.markdown("---")
+
+# Carica i dati
+try:
+    eval_df, user_df = load_data()
+
+    # Da quando sono aggiornati i dati mostrati (possono venire da uno snapshot su disco)
+    eval_store = get_evaluation_store()
+    if eval_store.as_of is not None:
+        marker = f"🕒 Data as of {eval_store.as_of:%Y-%m-%d %H:%M:%S} UTC"
+        if eval_store.refreshing or get_user_store().refreshing:
+            marker += " · refreshing from Google Sheets in the background, rerun to see the latest data"
+        st.caption(marker)
+    
+    if eval_df.empty:
+        st.info("No evaluation data available yet.")
+        st.stop()
+    
+    # Le colonne arrivano già tipizzate dallo store (punteggi int8, agent/domande/utenti categorici)
+    data_version = frame_version(eval_df)
+    
+    # === Metriche generali ===
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("Total Evaluations", len(eval_df))
+    
+    with col2:
+        unique_users = eval_df['user_id'].nunique()
+        st.metric("Active Evaluators", unique_users)
+    
+    with col3:
+        unique_questions = eval_df['question_id'].nunique()
+        st.metric("Questions Evaluated", unique_questions)
+    
+    with col4:
+        unique_agents = eval_df['agent'].nunique()
+        st.metric("AI Agents Compared", unique_agents)
+    
+    # === Tabella riassuntiva (sempre visibile, è l'aggregato più economico) ===
+    st.subheader("Summary Table")
+    def compute_summary():
+        summary = eval_df.groupby('agent', observed=True)[numeric_cols].mean().round(2)
+        summary['Count'] = eval_df.groupby('agent', observed=True).size()
+        return summary
+    summary_table = cached_aggregate("summary_table", data_version, compute_summary)
+    st.dataframe(summary_table, use_container_width=True)
+    
+    st.markdown("---")
+    
+    # === Analisi su richiesta ===
+    # Con on_change="rerun" solo la scheda aperta viene calcolata a ogni esecuzione
+    (agents_tab, distribution_tab, evaluators_tab, correlation_tab, bias_tab,
+     similarity_tab, map_tab, activity_tab, search_tab, raw_tab, quota_tab) = st.tabs(
+        ["🤖 Agents", "📈 Distribution", "👥 Evaluators", "🔗 Correlation", "📏 Length bias",
+         "🧬 Similarity", "🗺️ Map", "⏰ Activity", "🔎 Search", "🔍 Raw data", "📡 API quota"],
+        key="stats_section", on_change="rerun"
+    )
+    
+    if agents_tab.open:
+        with agents_tab:
+            agents_section(eval_df, data_version)
+    if distribution_tab.open:
+        with distribution_tab:
+            distribution_section(eval_df, data_version)
+    if evaluators_tab.open:
+        with evaluators_tab:
+            evaluators_section(eval_df, user_df, data_version)
+    if correlation_tab.open:
+        with correlation_tab:
+            correlation_section(eval_df, data_version)
+    if bias_tab.open:
+        with bias_tab:
+            length_bias_section(eval_df, data_version)
+    if similarity_tab.open:
+        with similarity_tab:
+            similarity_section(eval_df, data_version)
+    if map_tab.open:
+        with map_tab:
+            spatial_section(eval_df, data_version)
+    if activity_tab.open:
+        with activity_tab:
+            temporal_section(eval_df, data_version)
+    if search_tab.open:
+        with search_tab:
+            search_section(eval_df, data_version)
+    if raw_tab.open:
+        with raw_tab:
+            raw_data_section(eval_df)
+    if quota_tab.open:
+        with quota_tab:
+            quota_section()
 
 except Exception as e:
     st.error(f"Error loading data: {str(e)}")
     st.info("Make sure the Google Sheets are properly configured and accessible.")
-
-
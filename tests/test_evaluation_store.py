@@ -0,0 +1,151 @@
+import pandas as pd
+
+from utils.evaluation_store import USER_DTYPES, WorksheetStore, parse_rows, sync_stores
+from utils.fake_sheets import FakeSpreadsheet
+from utils.sheets import EVALUATION_COLUMNS, USER_COLUMNS, SheetsGateway
+from utils.shared_cache import SharedCache, SQLiteBackend
+
+
+def _user(user_id, role="researcher"):
+    return [user_id, f"name-{user_id}", "", role, "", "", "", "", "", ""]
+
+
+def _user_store(gateway, **kwargs):
+    return WorksheetStore(gateway, "users", USER_COLUMNS, dtypes=USER_DTYPES, **kwargs)
+
+
+def _record_ranges(spreadsheet, monkeypatch):
+    """Intervalli di ogni values_batch_get, una lista per chiamata"""
+    batches = []
+    values_batch_get = spreadsheet.values_batch_get
+
+    def recorded(ranges, params=None):
+        batches.append(list(ranges))
+        return values_batch_get(ranges, params)
+
+    monkeypatch.setattr(spreadsheet, "values_batch_get", recorded)
+    return batches
+
+
+def test_appended_rows_are_visible_at_their_sheet_row():
+    spreadsheet = FakeSpreadsheet()
+    store = _user_store(SheetsGateway(spreadsheet))
+
+    store.append(_user("u1"))
+    store.append(_user("u2"))
+
+    assert store.to_frame()["user_id"].tolist() == ["u1", "u2"]
+    assert store._materialize().index.tolist() == [2, 3]
+    assert "values_batch_get" not in spreadsheet.calls
+
+
+def test_sync_reads_only_the_tail_of_every_store_in_one_batch(monkeypatch):
+    spreadsheet = FakeSpreadsheet()
+    gateway = SheetsGateway(spreadsheet)
+    users = _user_store(gateway)
+    evaluations = WorksheetStore(gateway, "evaluations", EVALUATION_COLUMNS)
+    for i in range(3):
+        users.append(_user(f"u{i}"))
+    batches = _record_ranges(spreadsheet, monkeypatch)
+    sync_stores([users, evaluations], force=True)
+
+    # Righe scritte da un'altra replica
+    spreadsheet.worksheet("users").append_row(_user("other"))
+    sync_stores([users, evaluations], force=True)
+
+    assert batches[-1] == ["'evaluations'!A2:N", "'users'!A4:J"]
+    assert len(batches) == 2
+    assert users.to_frame()["user_id"].tolist() == ["u0", "u1", "u2", "other"]
+
+
+def test_new_categories_are_merged_into_the_frame():
+    spreadsheet = FakeSpreadsheet()
+    store = _user_store(SheetsGateway(spreadsheet))
+    rows = [_user("u1", "researcher"), _user("u2", "student")]
+    store.append(rows[0])
+    assert store.to_frame()["role"].cat.categories.tolist() == ["researcher"]
+
+    store.append(rows[1])
+    spreadsheet.worksheet("users").append_row(_user("u3", "journalist"))
+    rows.append(_user("u3", "journalist"))
+    store.sync(force=True)
+
+    frame = store.to_frame()
+    assert sorted(frame["role"].cat.categories) == ["journalist", "researcher", "student"]
+    pd.testing.assert_frame_equal(frame, parse_rows(rows, USER_COLUMNS, USER_DTYPES), check_categorical=False)
+
+
+def test_rows_arriving_out_of_order_are_sorted_by_sheet_row():
+    spreadsheet = FakeSpreadsheet()
+    store = _user_store(SheetsGateway(spreadsheet))
+    store.append(_user("u1"))
+    store.append(_user("u2"))
+    store.sync(force=True)
+    spreadsheet.worksheet("users").append_row(_user("other"))
+    store.append(_user("u3"))
+    assert store.to_frame()["user_id"].tolist() == ["u1", "u2", "u3"]
+
+    store.sync(force=True)
+
+    assert store.to_frame()["user_id"].tolist() == ["u1", "u2", "other", "u3"]
+    assert store._materialize().index.tolist() == [2, 3, 4, 5]
+
+
+def test_replicas_share_the_frame_and_lease_the_reads(tmp_path):
+    spreadsheet = FakeSpreadsheet()
+    cache = SharedCache(SQLiteBackend(str(tmp_path / "cache.db")))
+    first = _user_store(SheetsGateway(spreadsheet, cache=cache))
+    second_gateway = SheetsGateway(spreadsheet, cache=cache)
+    second = _user_store(second_gateway)
+    first.append(_user("u1"))
+    first.sync(force=True)
+    reads = spreadsheet.calls["values_batch_get"]
+
+    second.sync()
+    assert spreadsheet.calls["values_batch_get"] == reads
+    assert second_gateway.quota_status()["shared_hits"] == 1
+    pd.testing.assert_frame_equal(second.to_frame(), first.to_frame())
+
+    # La scrittura invalida la copia condivisa; la prima replica sta già rileggendo il foglio
+    first.append(_user("u2"))
+    assert cache.lease("ws:users", "frame", ttl=60)
+    second.sync(force=True)
+    assert spreadsheet.calls["values_batch_get"] == reads
+    assert second.to_frame()["user_id"].tolist() == ["u1"]
+
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.snapshots.SNAPSHOT_DIR", str(tmp_path))
+    spreadsheet = FakeSpreadsheet()
+    store = _user_store(SheetsGateway(spreadsheet), snapshot_name="users", snapshot_interval=0)
+    for i in range(3):
+        store.append(_user(f"u{i}", role=f"role-{i % 2}"))
+    store.sync(force=True)
+    store._snapshot_thread.join()
+
+    restarted = _user_store(SheetsGateway(spreadsheet), snapshot_name="users")
+    pd.testing.assert_frame_equal(restarted.to_frame(), store.to_frame())
+    assert restarted.as_of == store.as_of
+
+    # Riga cancellata mentre il processo era fermo: la prima sincronizzazione rilegge tutto
+    del spreadsheet.worksheet("users")._rows[2]
+    restarted.sync()
+    assert restarted.to_frame()["user_id"].tolist() == ["u0", "u2"]
+
+
+def test_deleted_rows_trigger_a_full_reload(monkeypatch):
+    spreadsheet = FakeSpreadsheet()
+    store = _user_store(SheetsGateway(spreadsheet))
+    for i in range(5):
+        store.append(_user(f"u{i}"))
+    store.sync(force=True)
+    batches = _record_ranges(spreadsheet, monkeypatch)
+
+    worksheet = spreadsheet.worksheet("users")
+    del worksheet._rows[2]  # riga 3 del foglio, u1
+    worksheet.append_row(_user("other"))
+    store.sync(force=True)
+
+    assert batches == [["'users'!A6:J"], ["'users'!A2:J"]]
+    assert store.to_frame()["user_id"].tolist() == ["u0", "u2", "u3", "u4", "other"]
+    assert store._materialize().index.tolist() == [2, 3, 4, 5, 6]
@@ -0,0 +1,136 @@
+import threading
+
+import gspread
+import pytest
+
+from utils.fake_sheets import FakeSpreadsheet, _api_error
+from utils.shared_cache import SharedCache, SQLiteBackend
+from utils.sheets import SheetsGateway
+
+
+class FakeClock:
+    """Clock simulato: `sleep` registra il ritardo e fa avanzare il tempo"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_identical_reads_in_flight_are_coalesced():
+    spreadsheet = FakeSpreadsheet(latency=0.2)
+    gateway = SheetsGateway(spreadsheet)
+    sessions = 8
+    barrier = threading.Barrier(sessions)
+    results = []
+
+    def session():
+        barrier.wait()
+        results.append(gateway.batch_get_values(["evaluations!A1:B1", "users!A1:B1"]))
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [[[["user_id", "question_id"]], [["user_id", "username"]]]] * sessions
+    assert spreadsheet.calls["values_batch_get"] == 1
+    assert gateway.quota_status()["coalesced"] == sessions - 1
+
+
+def test_429_is_retried_with_backoff(monkeypatch):
+    # Senza jitter il ritardo è il limite superiore della finestra di backoff
+    monkeypatch.setattr("utils.sheets.random.uniform", lambda low, high: high)
+    clock = FakeClock()
+    # Con questo seed le prime due richieste ricevono un 429, la terza no
+    spreadsheet = FakeSpreadsheet(error_rate=0.5, seed=7)
+    gateway = SheetsGateway(spreadsheet, base_delay=1.0, sleep=clock.sleep, clock=clock)
+
+    assert gateway.batch_get_values(["evaluations!A1:B1"]) == [[["user_id", "question_id"]]]
+    assert clock.sleeps == [1.0, 2.0]
+    status = gateway.quota_status()
+    assert (status["throttled"], status["retries"], status["failures"]) == (2, 2, 0)
+
+
+def test_backoff_respects_max_delay_and_gives_up(monkeypatch):
+    monkeypatch.setattr("utils.sheets.random.uniform", lambda low, high: high)
+    clock = FakeClock()
+    spreadsheet = FakeSpreadsheet(error_rate=1.0)
+    gateway = SheetsGateway(spreadsheet, max_retries=5, base_delay=1.0, max_delay=4.0, sleep=clock.sleep, clock=clock)
+
+    with pytest.raises(gspread.exceptions.APIError):
+        gateway.batch_get_values(["evaluations!A1:B1"])
+    assert clock.sleeps == [1.0, 2.0, 4.0, 4.0, 4.0]
+    assert spreadsheet.calls["values_batch_get"] == 6
+    assert gateway.quota_status()["failures"] == 1
+
+
+def test_append_row_is_not_retried_on_server_errors(monkeypatch):
+    clock = FakeClock()
+    spreadsheet = FakeSpreadsheet()
+    gateway = SheetsGateway(spreadsheet, sleep=clock.sleep, clock=clock)
+    worksheet = gateway.worksheet("users")
+
+    def append_row(values):
+        raise _api_error(503, "The service is currently unavailable.", "UNAVAILABLE")
+
+    monkeypatch.setattr(worksheet, "append_row", append_row)
+    with pytest.raises(gspread.exceptions.APIError):
+        gateway.append_row("users", ["u1", "alice"])
+    assert clock.sleeps == []
+    status = gateway.quota_status()
+    assert (status["writes"], status["retries"], status["failures"]) == (1, 0, 1)
+
+
+def test_limiter_holds_calls_to_the_quota(monkeypatch):
+    clock = FakeClock()
+    spreadsheet = FakeSpreadsheet()
+    gateway = SheetsGateway(spreadsheet, read_quota_per_minute=60, sleep=clock.sleep, clock=clock)
+    calls = []
+    values_batch_get = spreadsheet.values_batch_get
+
+    def timed_batch_get(ranges, params=None):
+        calls.append(clock.now)
+        return values_batch_get(ranges, params)
+
+    monkeypatch.setattr(spreadsheet, "values_batch_get", timed_batch_get)
+    for _ in range(150):
+        gateway.batch_get_values(["evaluations!A1:B1"])
+        clock.now += 0.01
+
+    # In nessun intervallo di 60 secondi passano più chiamate della quota
+    assert max(sum(start <= t < start + 60 for t in calls) for start in calls) == 60
+    assert sum(t < 60 for t in calls) == 60
+
+
+def test_replicas_share_the_quota(tmp_path, monkeypatch):
+    clock = FakeClock()
+    clock.now = 1_000_000.0
+    cache = SharedCache(SQLiteBackend(str(tmp_path / "cache.db")))
+    calls = []
+    replicas = []
+    for _ in range(2):
+        spreadsheet = FakeSpreadsheet()
+        values_batch_get = spreadsheet.values_batch_get
+
+        def timed_batch_get(ranges, params=None, values_batch_get=values_batch_get):
+            calls.append(clock.now)
+            return values_batch_get(ranges, params)
+
+        monkeypatch.setattr(spreadsheet, "values_batch_get", timed_batch_get)
+        replicas.append(SheetsGateway(spreadsheet, read_quota_per_minute=60, sleep=clock.sleep, clock=clock, cache=cache))
+
+    for i in range(150):
+        replicas[i % 2].batch_get_values(["evaluations!A1:B1"])
+        clock.now += 0.01
+
+    assert max(sum(start <= t < start + 60 for t in calls) for start in calls) <= 60
+    assert calls[-1] - calls[0] > 120
+    assert replicas[0].quota_status()["read_available"] == replicas[1].quota_status()["read_available"]
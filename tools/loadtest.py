@@ -0,0 +1,351 @@
+"""Prova di carico della pagina Evaluation contro il finto Google Sheet.
+
+Avvia `streamlit run Home.py` con il foglio finto (latenza, quota ed errori
+configurabili, vedi `utils/fake_sheets.py`) e simula N valutatori concorrenti
+che parlano con il server tramite il websocket di Streamlit, come farebbe il
+browser: ogni sessione apre la pagina Evaluation, fa login, si registra,
+valuta e invia `--evaluations` coppie.
+
+I livelli di concorrenza vengono provati in ordine, ognuno su un server nuovo.
+Per ogni livello si riportano la latenza degli invii (percentili), le chiamate
+API per valutazione, la crescita della memoria del server e gli errori; alla
+fine si indica il primo livello con errori.
+
+    python tools/loadtest.py --sessions 1,5,10,20,50 --evaluations 5 --latency 0.2 --quota 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+import websockets
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SLIDER_KEYS = ["rel_A", "cred_A", "uncer_A", "action_A", "rel_B", "cred_B", "uncer_B", "action_B"]
+
+FINISHED_SUCCESSFULLY = ForwardMsg.ScriptFinishedStatus.Value("FINISHED_SUCCESSFULLY")
+FINISHED_WITH_COMPILE_ERROR = ForwardMsg.ScriptFinishedStatus.Value("FINISHED_WITH_COMPILE_ERROR")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Evaluation page against the fake Google Sheet.")
+    parser.add_argument("--sessions", default="1,5,10,20", help="comma-separated concurrency levels (default: 1,5,10,20)")
+    parser.add_argument("--evaluations", type=int, default=3, help="pairs submitted by each session (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake Sheets latency per call, seconds (default: 0.1)")
+    parser.add_argument("--quota", type=int, default=None, help="fake Sheets requests/minute before 429 (default: none)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a spontaneous 429 (default: 0)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds before a page run counts as stalled (default: 60)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds a rater spends before each submit (default: 0)")
+    parser.add_argument("--stop-on-error", action="store_true", help="stop at the first level with errors")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+# === Server ===
+class Server:
+    """`streamlit run Home.py` on a free port, with the fake spreadsheet"""
+
+    def __init__(self, args):
+        self.workdir = tempfile.mkdtemp(prefix="climaiscore-loadtest-")
+        self.stats_path = os.path.join(self.workdir, "sheets-stats.json")
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ)
+        env.pop("CLIMAISCORE_SHARED_CACHE", None)
+        env.update({
+            "CLIMAISCORE_FAKE_SHEETS": "1",
+            "CLIMAISCORE_FAKE_SHEETS_LATENCY": str(args.latency),
+            "CLIMAISCORE_FAKE_SHEETS_ERROR_RATE": str(args.error_rate),
+            "CLIMAISCORE_FAKE_SHEETS_STATS": self.stats_path,
+            "CLIMAISCORE_SNAPSHOT_DIR": os.path.join(self.workdir, "snapshots"),
+        })
+        if args.quota:
+            env["CLIMAISCORE_FAKE_SHEETS_QUOTA"] = str(args.quota)
+        self._log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", "Home.py",
+             "--server.headless", "true", "--server.port", str(self.port),
+             "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+            cwd=ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+        self._wait_ready()
+
+    def _wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f"Streamlit exited early, see {self._log.name}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.25)
+        raise SystemExit(f"Streamlit did not start within {timeout}s, see {self._log.name}")
+
+    def rss_bytes(self):
+        """Memoria residente del processo server (Linux)"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def sheets_stats(self):
+        try:
+            with open(self.stats_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"calls": {}, "throttled": 0}
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+# === Sessione simulata ===
+class PageError(Exception):
+    pass
+
+
+class EvaluatorSession:
+    """A browser tab on the Evaluation page, driven through the Streamlit websocket."""
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self.page_hash = ""
+        self.widgets = {}  # id -> (tipo, proto) degli elementi dell'ultima esecuzione
+
+    async def __aenter__(self):
+        self._ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._ws.close()
+
+    async def run(self, widget_states=()):
+        """Runs the page with the given widget states and waits for the final script run.
+
+        Runs ended by st.rerun() are followed to the end; exceptions and error
+        messages shown by the page raise PageError.
+        """
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = self.page_hash
+        msg.rerun_script.widget_states.widgets.extend(widget_states)
+        await self._ws.send(msg.SerializeToString())
+
+        errors = []
+        self.widgets = {}
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self._ws.recv(), self.timeout))
+            kind = forward.WhichOneof("type")
+            if kind == "navigation" and not self.page_hash:
+                pages = {page.page_name: page.page_script_hash for page in forward.navigation.app_pages}
+                self.page_hash = pages["Evaluation"]
+            elif kind == "delta" and forward.delta.HasField("new_element"):
+                element = forward.delta.new_element
+                element_type = element.WhichOneof("type")
+                proto = getattr(element, element_type)
+                if element_type == "exception":
+                    errors.append(f"{proto.type}: {proto.message}")
+                elif element_type == "alert" and proto.format == Alert.ERROR:
+                    errors.append(proto.body)
+                elif getattr(proto, "id", ""):
+                    self.widgets[proto.id] = (element_type, proto)
+            elif kind == "script_finished":
+                if forward.script_finished in (FINISHED_SUCCESSFULLY, FINISHED_WITH_COMPILE_ERROR):
+                    break
+                # Esecuzione interrotta da st.rerun(): i messaggi della successiva seguono
+                errors, self.widgets = [], {}
+        if errors:
+            raise PageError(errors[0])
+
+    def widget(self, key=None, label=None):
+        """Id del widget con la `key` data (o, per i bottoni senza key, con la `label`)"""
+        for widget_id, (_, proto) in self.widgets.items():
+            if (key is not None and widget_id.endswith(f"-{key}")) or (label is not None and proto.label == label):
+                return widget_id
+        raise PageError(f"widget {key or label!r} not on the page")
+
+    def form_submitter(self):
+        for widget_id, (element_type, proto) in self.widgets.items():
+            if element_type == "button" and proto.is_form_submitter:
+                return widget_id
+        raise PageError("no form submit button on the page")
+
+
+def _state(widget_id, **value):
+    state = BackMsg().rerun_script.widget_states.widgets.add()
+    state.id = widget_id
+    for field, v in value.items():
+        if field == "double_array_value":
+            state.double_array_value.data.extend(v)
+        else:
+            setattr(state, field, v)
+    return state
+
+
+async def evaluator(name, server, args, result):
+    """Login, registrazione e `args.evaluations` invii; tempi ed errori in `result`"""
+    try:
+        async with EvaluatorSession(server.url, args.timeout) as session:
+            started = time.perf_counter()
+            # La prima esecuzione apre Home e rivela l'hash della pagina Evaluation
+            await session.run()
+            await session.run()
+            await session.run([
+                _state(session.widget(key="login_username"), string_value=name),
+                _state(session.widget(key="login_button"), trigger_value=True),
+            ])
+            # Form di registrazione: tutti i campi sono facoltativi
+            await session.run([_state(session.form_submitter(), trigger_value=True)])
+            result["login"] = time.perf_counter() - started
+
+            for i in range(args.evaluations):
+                states = [
+                    _state(session.widget(key=key), double_array_value=[1 + (i + len(key)) % 10])
+                    for key in SLIDER_KEYS
+                ]
+                states.append(_state(session.widget(label="✅ Send Evaluation"), trigger_value=True))
+                if args.think_time:
+                    await asyncio.sleep(args.think_time)
+                started = time.perf_counter()
+                await session.run(states)
+                result["submits"].append(time.perf_counter() - started)
+                result["evaluations"] += 1
+    except asyncio.TimeoutError:
+        result["errors"].append(f"page run stalled for more than {args.timeout}s")
+    except Exception as e:
+        result["errors"].append(str(e) if isinstance(e, PageError) else f"{type(e).__name__}: {e}")
+
+
+def _new_result():
+    return {"login": None, "submits": [], "evaluations": 0, "errors": []}
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": p50, "p90": p90, "p99": p99, "max": max(values)}
+
+
+def run_level(level, sessions, args):
+    """`sessions` valutatori concorrenti contro un server nuovo, dopo una sessione di riscaldamento"""
+    server = Server(args)
+    try:
+        # Il riscaldamento carica corpus, similarità e HTML delle risposte, esclusi dalle misure
+        warm_up = _new_result()
+        asyncio.run(evaluator(f"warmup-{level}", server, argparse.Namespace(**{**vars(args), "evaluations": 1, "think_time": 0}), warm_up))
+        if warm_up["errors"]:
+            raise SystemExit(f"Warm-up session failed: {warm_up['errors'][0]}")
+
+        stats_before = server.sheets_stats()
+        rss_before = server.rss_bytes()
+        results = [_new_result() for _ in range(sessions)]
+
+        async def run_all():
+            await asyncio.gather(*(evaluator(f"load-{level}-{i}", server, args, results[i]) for i in range(sessions)))
+
+        started = time.perf_counter()
+        asyncio.run(run_all())
+        elapsed = time.perf_counter() - started
+        rss_after = server.rss_bytes()
+        stats_after = server.sheets_stats()
+    finally:
+        server.stop()
+
+    calls = {
+        method: count - stats_before["calls"].get(method, 0)
+        for method, count in stats_after["calls"].items()
+        if count - stats_before["calls"].get(method, 0)
+    }
+    evaluations = sum(r["evaluations"] for r in results)
+    errors = [e for r in results for e in r["errors"]]
+    return {
+        "sessions": sessions,
+        "evaluations": evaluations,
+        "elapsed": elapsed,
+        "evaluations_per_minute": 60 * evaluations / elapsed if elapsed else 0,
+        "login_p50": percentiles([r["login"] for r in results if r["login"] is not None])["p50"],
+        "submit": percentiles([s for r in results for s in r["submits"]]),
+        "api_calls": calls,
+        # Una valutazione è una coppia inviata (due righe scritte)
+        "api_calls_per_evaluation": sum(calls.values()) / evaluations if evaluations else None,
+        "throttled": stats_after["throttled"] - stats_before["throttled"],
+        "rss_growth_mb": None if rss_before is None else (rss_after - rss_before) / 2 ** 20,
+        "rss_mb": None if rss_after is None else rss_after / 2 ** 20,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+    }
+
+
+def format_report(levels):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    def number(value, fmt):
+        return "-" if value is None else format(value, fmt)
+
+    header = (f"{'sessions':>8} {'evals':>6} {'evals/min':>9} {'login p50':>9} {'submit p50':>10} {'p90':>7} {'p99':>7} "
+              f"{'max':>7} {'calls/eval':>10} {'429s':>5} {'RSS +MB':>8} {'errors':>6}")
+    lines = [header, "-" * len(header)]
+    for r in levels:
+        lines.append(
+            f"{r['sessions']:>8} {r['evaluations']:>6} {r['evaluations_per_minute']:>9.1f} {ms(r['login_p50']):>9} "
+            f"{ms(r['submit']['p50']):>10} {ms(r['submit']['p90']):>7} {ms(r['submit']['p99']):>7} {ms(r['submit']['max']):>7} "
+            f"{number(r['api_calls_per_evaluation'], '.2f'):>10} {r['throttled']:>5} {number(r['rss_growth_mb'], '.1f'):>8} {r['errors']:>6}"
+        )
+    lines.append("(latencies in ms; a submit is the page run that saves a pair and loads the next one)")
+    failing = next((r for r in levels if r["errors"]), None)
+    if failing is None:
+        lines.append(f"No errors up to {levels[-1]['sessions']} concurrent sessions.")
+    else:
+        lines.append(f"Errors begin at {failing['sessions']} concurrent sessions, e.g. {failing['error_samples'][0]}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = [int(n) for n in args.sessions.split(",") if n.strip()]
+    print(f"Fake Sheets: latency {args.latency}s, quota {args.quota or 'none'}/min, error rate {args.error_rate}", flush=True)
+
+    results = []
+    for level, sessions in enumerate(levels):
+        print(f"Running {sessions} concurrent sessions x {args.evaluations} evaluations...", flush=True)
+        result = run_level(level, sessions, args)
+        results.append(result)
+        if result["errors"] and args.stop_on_error:
+            break
+
+    print()
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import streamlit as st
+
+from utils.shared_cache import get_shared_cache
+
+RESPONSE_BASE_PATH = "responses/gpt-4.1"
+
+BASELINE_AGENT = "Plain-LLM"
+ALTERNATIVE_AGENTS = ["Climsight", "Climsight-XCLIM", "XCLIM-AI"]
+AGENTS = [BASELINE_AGENT] + ALTERNATIVE_AGENTS
+
+
+def split_sections(response_text):
+    # Estrae blocchi principali (naive, da migliorare se serve)
+    sections = {}
+    current = None
+    for line in response_text.split("\n"):
+        line = line.strip()
+
+        # Salta linee che creano linee orizzontali
+        if line in ("---", "***", "___"):
+            continue
+
+        if line.lower().startswith("### executive summary"):
+            current = "Executive summary"
+            sections[current] = ""
+        elif line.lower().startswith("### uncertainty"):
+            current = "Uncertainty"
+            sections[current] = ""
+        elif line.lower().startswith("### actionability"):
+            current = "Actionability"
+            sections[current] = ""
+        elif line.lower().startswith("### credibility"):
+            current = "Credibility"
+            sections[current] = ""
+        elif current:
+            sections[current] += line + "\n"
+    return sections
+
+# === Caricamento risposte ===
+@st.cache_data
+def load_response(agent_name, idx):
+    path = os.path.join(RESPONSE_BASE_PATH, agent_name, f"response_{idx}.json")
+    with open(path, "r") as f:
+        return json.load(f)
+
+@st.cache_data
+def get_available_indices():
+    return [f.split("_")[1].split(".")[0] for f in os.listdir(os.path.join(RESPONSE_BASE_PATH, "Plain-LLM"))]
+
+@st.cache_data(ttl=60)
+def corpus_version():
+    """Hash di nomi, dimensioni e date di modifica dei file di risposta"""
+    digest = hashlib.sha1()
+    for agent in AGENTS:
+        folder = os.path.join(RESPONSE_BASE_PATH, agent)
+        for name in sorted(os.listdir(folder)):
+            stat = os.stat(os.path.join(folder, name))
+            digest.update(f"{agent}/{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+@st.cache_data
+def get_sections(agent_name, idx, version):
+    """Sezioni di una risposta, condivise tra le repliche tramite la cache condivisa"""
+    cache = get_shared_cache()
+    if cache is None:
+        return split_sections(load_response(agent_name, idx)["ResponseText"])
+    return cache.get_or_compute(
+        "corpus",
+        f"sections:{version}:{agent_name}:{idx}",
+        lambda: split_sections(load_response(agent_name, idx)["ResponseText"]),
+    )
+
+@st.cache_data
+def load_corpus_table(version):
+    """Una riga per (domanda, agent) con metadati e testo della risposta"""
+    records = []
+    for agent in AGENTS:
+        for idx in get_available_indices():
+            response = load_response(agent, idx)
+            records.append({
+                "question_id": f"Q{idx}",
+                "agent": agent,
+                "lat": response.get("Lat"),
+                "lon": response.get("Lon"),
+                "theme": response.get("Theme", ""),
+                "category": response.get("Category", ""),
+                "question_text": response.get("QuestionText", ""),
+                "response_text": response.get("ResponseText", ""),
+            })
+    return pd.DataFrame(records)
@@ -0,0 +1,113 @@
+"""Cache dei risultati derivati della pagina Statistics: aggregati e figure Plotly.
+
+Gli aggregati sono indicizzati per nome e versione dei dati, le figure per nome
+e hash del contenuto dei dati da cui derivano: finché i dati non cambiano, i
+rerun riusano il risultato già pronto. Entrambi sono tenuti in un LRU per
+processo, condiviso tra le sessioni, e pubblicati nella cache condivisa tra le
+repliche (se configurata).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.io as pio
+import streamlit as st
+
+from utils.shared_cache import get_shared_cache
+
+# Voci tenute in memoria per processo (LRU)
+AGGREGATE_CACHE_SIZE = 256
+FIGURE_CACHE_SIZE = 128
+
+AGGREGATE_TTL = 3600
+FIGURE_TTL = 3600
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU, shared by the sessions of the process."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource
+def _aggregates():
+    return LRUCache(AGGREGATE_CACHE_SIZE)
+
+
+@st.cache_resource
+def _figures():
+    return LRUCache(FIGURE_CACHE_SIZE)
+
+
+def _cached(memory, namespace, key, compute, ttl, dump=None, load=None):
+    """Valore di `key`: dall'LRU, poi dalla cache condivisa, altrimenti `compute()`.
+
+    `dump`/`load` convertono il valore da e verso la forma salvata nella cache condivisa.
+    """
+    value = memory.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    cache = get_shared_cache()
+    if cache is None:
+        value = compute()
+    elif dump is None:
+        value = cache.get_or_compute(namespace, key, compute, ttl=ttl)
+    else:
+        value = load(cache.get_or_compute(namespace, key, lambda: dump(compute()), ttl=ttl))
+    memory.put(key, value)
+    return value
+
+
+def content_hash(*parts):
+    """Hash di DataFrame/Series (valori, indice e colonne) e di valori semplici"""
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+            labels = part.columns if isinstance(part, pd.DataFrame) else [part.name]
+            digest.update(repr(list(labels)).encode("utf-8"))
+        else:
+            digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def cached_aggregate(name, data_version, compute):
+    """Aggregati derivati, memorizzati per versione dei dati. Il risultato è condiviso:
+    non va modificato sul posto."""
+    return _cached(_aggregates(), "aggregates", f"{name}:{data_version}", compute, AGGREGATE_TTL)
+
+
+def cached_figure(name, build, *data):
+    """Figure `name` for the content of `data`, built with `build()` only on a miss.
+
+    The shared cache holds the serialised JSON; in memory the figure is kept
+    already validated, because st.plotly_chart would validate a plain dict
+    spec again on every call. The returned figure is shared between sessions
+    and must not be modified.
+    """
+    return _cached(
+        _figures(), "figures", f"{name}:{content_hash(*data)}", build, FIGURE_TTL,
+        dump=lambda figure: pio.to_json(figure, validate=False),
+        load=lambda spec: pio.from_json(spec, skip_invalid=True),
+    )
@@ -0,0 +1,444 @@
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from gspread.utils import absolute_range_name, rowcol_to_a1
+from pandas.api.types import union_categoricals
+
+from utils.sheets import EVALUATION_COLUMNS, USER_COLUMNS, get_gateway
+from utils.snapshots import latest_snapshot, write_snapshot
+
+# Ogni quanto rileggere la coda del foglio per le righe scritte da altre repliche
+REFRESH_INTERVAL = 60
+
+# Ogni quanto rileggere tutto il foglio, per le righe modificate a mano
+FULL_RELOAD_INTERVAL = 300
+
+# Intervallo minimo tra due snapshot su disco dello stesso foglio
+SNAPSHOT_INTERVAL = 60
+
+SCORE_COLUMNS = ["relevance", "credibility", "uncertainty", "actionability"]
+TIMING_COLUMNS = [col for col in EVALUATION_COLUMNS if col.endswith("_seconds")]
+
+# Tipi delle colonne, applicati direttamente ai valori grezzi delle celle
+EVALUATION_DTYPES = {
+    "user_id": "category",
+    "question_id": "category",
+    "agent": "category",
+    **{col: "score" for col in SCORE_COLUMNS},
+    "timestamp": "datetime",
+    "shown_at": "datetime",
+    **{col: "float32" for col in TIMING_COLUMNS},
+}
+USER_DTYPES = {
+    col: "category"
+    for col in ["role", "institution", "climate_experience", "education_level", "geographic_region", "ai_familiarity"]
+}
+
+
+# Lettura pianificata da sync_stores: intervallo A1, prima riga, ultima riga presente
+# nello store, lettura dell'intero foglio, versione della cache condivisa
+SyncPlan = namedtuple("SyncPlan", "range start last_held full cache_version")
+
+
+def _row_number(append_response):
+    """Numero di riga scritto da append_row, letto da `updates.updatedRange`"""
+    updated_range = ((append_response or {}).get("updates") or {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+
+def _parse_scores(values):
+    try:
+        return values.astype(np.int8)
+    except (TypeError, ValueError, OverflowError):
+        # Celle vuote o non intere (es. modificate a mano nel foglio): float32 con NaN
+        return pd.to_numeric(values, errors="coerce").astype(np.float32)
+
+
+def _parse_column(values, kind):
+    """Colonna tipizzata da un array di celle (stringhe)"""
+    if kind == "category":
+        return pd.Categorical(values.astype(str))
+    if kind == "score":
+        return _parse_scores(values)
+    if kind == "float32":
+        return pd.to_numeric(values, errors="coerce").astype(np.float32)
+    if kind == "datetime":
+        return pd.to_datetime(values, errors="coerce", utc=True, format="ISO8601").array
+    return values.astype(str)
+
+
+def parse_rows(rows, columns, dtypes, index=None):
+    """Typed DataFrame straight from raw cell values (lists of strings), column by column.
+
+    `dtypes` maps a column to "category" (dictionary-encoded), "score" (int8),
+    "float32" or "datetime" (UTC); the other columns stay strings.
+    """
+    width = len(columns)
+    cells = np.array([list(values[:width]) + [""] * (width - len(values)) for values in rows], dtype=object)
+    cells = cells.reshape(len(rows), width)
+    data = {col: _parse_column(cells[:, i], dtypes.get(col)) for i, col in enumerate(columns)}
+    return pd.DataFrame(data, columns=columns, index=index)
+
+
+def _conform(df, dtypes):
+    """Riporta ai tipi di `dtypes` un frame letto da uno snapshot (anche nel vecchio formato a stringhe)"""
+    data = {}
+    for col in df.columns:
+        values, kind = df[col], dtypes.get(col)
+        if kind == "category":
+            ok = isinstance(values.dtype, pd.CategoricalDtype)
+        elif kind in ("score", "float32"):
+            ok = pd.api.types.is_numeric_dtype(values.dtype) and not isinstance(values.dtype, pd.CategoricalDtype)
+        elif kind == "datetime":
+            ok = pd.api.types.is_datetime64_any_dtype(values.dtype)
+        else:
+            ok = not isinstance(values.dtype, pd.CategoricalDtype)
+        data[col] = values.array if ok else _parse_column(values.astype(str).to_numpy(dtype=object), kind)
+    return pd.DataFrame(data, columns=df.columns, index=df.index)
+
+
+def _concat_typed(frames):
+    """Concatena frame tipizzati (indice compreso), unendo i dizionari delle colonne categoriche"""
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    data = {}
+    for col in frames[0].columns:
+        parts = [frame[col] for frame in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            data[col] = union_categoricals(parts)
+        else:
+            data[col] = pd.concat(parts).array
+    return pd.DataFrame(data, index=frames[0].index.append([frame.index for frame in frames[1:]]))
+
+
+def _same_values(a, b):
+    """True se due frame tipizzati con lo stesso indice hanno gli stessi valori
+    (i dizionari delle categorie e il tipo dei punteggi possono differire)"""
+    for col in a.columns:
+        x, y = a[col], b[col]
+        same = (x.to_numpy(dtype=object) == y.to_numpy(dtype=object)) | (x.isna().to_numpy() & y.isna().to_numpy())
+        if not same.all():
+            return False
+    return True
+
+
+def _add_rows(frame, new_rows):
+    """`frame` con `new_rows` aggiunte (o sostituite), in ordine di riga"""
+    if not len(new_rows):
+        return frame
+    if len(frame) and new_rows.index[0] <= frame.index[-1]:
+        # Righe fuori ordine o già presenti: si ricostruisce l'ordine
+        frame = frame[~frame.index.isin(new_rows.index)]
+        return _concat_typed([frame, new_rows]).sort_index()
+    return _concat_typed([frame, new_rows])
+
+
+class WorksheetStore:
+    """Thread-safe in-memory copy of an append-only worksheet.
+
+    The copy is a single typed DataFrame (see `parse_rows`) indexed by the
+    sheet row number `_row`. Rows appended through the store are visible
+    immediately (write-through) and are parsed into the frame the next time
+    it is needed; `sync()` only reads the tail of the sheet, i.e. the rows
+    written by other replicas, starting one row before the first row the
+    store does not hold yet. If the rows already held no longer match the
+    sheet (rows deleted, inserted or edited by hand) the whole sheet is read
+    again; it is also read in full every `FULL_RELOAD_INTERVAL`. With a
+    shared cache the frame read by one replica is published for the others.
+
+    With `snapshot_name` the store starts from the latest Parquet snapshot on
+    disk; after a sync, if the data changed, a background thread writes a new
+    one (at most once per `snapshot_interval`). The first sync after loading a
+    snapshot reads the whole sheet, since rows may have been deleted or edited
+    while the process was down.
+    """
+
+    def __init__(
+        self, gateway, worksheet_name, columns, refresh_interval=REFRESH_INTERVAL, snapshot_name=None, dtypes=None,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+    ):
+        self._gateway = gateway
+        self.worksheet_name = worksheet_name
+        self.columns = list(columns)
+        self.dtypes = dict(dtypes or {})
+        self.refresh_interval = refresh_interval
+        self.snapshot_name = snapshot_name
+        self.snapshot_interval = snapshot_interval
+        self._frame = parse_rows([], self.columns, self.dtypes, index=pd.Index([], dtype=np.int64, name="_row"))
+        self._pending = {}  # righe scritte da questo processo, non ancora convertite: numero di riga -> valori
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_sync = None
+        self._last_full_sync = None
+        self._version = 0
+        self._snapshot_version = 0
+        self._snapshot_thread = None
+        self._last_snapshot = None
+        self._refresh_thread = None
+        self.as_of = None  # quando i dati sono stati letti dal foglio l'ultima volta
+        if snapshot_name:
+            self._load_snapshot()
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def refreshing(self):
+        return self._refresh_thread is not None and self._refresh_thread.is_alive()
+
+    def _has_rows(self):
+        with self._lock:
+            return bool(len(self._frame) or self._pending)
+
+    def append(self, values):
+        response = self._gateway.append_row(self.worksheet_name, values)
+        row = _row_number(response)
+        if row is None:
+            # Posizione sconosciuta: la riga arriverà con la prossima sincronizzazione
+            self.sync(force=True)
+            return
+        with self._lock:
+            self._pending[row] = [str(v) for v in values]
+            self._version += 1
+
+    def sync(self, force=False, background=False):
+        """Reads the rows the store is missing, at most once per `refresh_interval`.
+
+        With `background=True` and data already available (e.g. from a snapshot)
+        the read happens in a daemon thread and the call returns immediately.
+        """
+        sync_stores([self], force=force, background=background)
+
+    def to_frame(self):
+        """Typed DataFrame of all known rows, in sheet order.
+
+        The result shares its data with the store (copy-on-write), so it costs
+        no extra memory until the caller modifies it.
+        """
+        with self._lock:
+            return self._materialize().reset_index(drop=True)
+
+    def _materialize(self):
+        """Converte le righe in attesa e le aggiunge al frame; da chiamare con il lock preso"""
+        if self._pending:
+            rows = sorted(self._pending.items())
+            new_rows = parse_rows(
+                [values for _, values in rows], self.columns, self.dtypes,
+                index=pd.Index([row for row, _ in rows], dtype=np.int64, name="_row"),
+            )
+            self._frame = _add_rows(self._frame, new_rows)
+            self._pending = {}
+        return self._frame
+
+    def _plan_sync(self):
+        """SyncPlan of the range still to read from the sheet, or None when the
+        shared cache already provided the rows (or another replica is reading them).
+
+        The tail read starts one row early, at the last row the store holds, so
+        that `_apply_sync` can tell whether the rows already held still match.
+        Every `FULL_RELOAD_INTERVAL` the whole sheet is read instead, to pick up
+        rows edited by hand; an empty store may start from the shared frame.
+        """
+        full = self._full_reload_due()
+        cache = self._gateway.cache
+        namespace = f"ws:{self.worksheet_name}"
+        cache_version = None
+        if cache is not None:
+            cache_version = cache.version(namespace)
+            # Uno store vuoto può partire dalla copia pubblicata, già verificata sul foglio
+            shared = None if full and self._has_rows() else cache.get(namespace, "frame")
+            if shared is not None:
+                self._gateway.record_shared_hit()
+                if full:
+                    self._last_full_sync = time.monotonic()
+                self._merge(shared)
+                self._synced()
+                return None
+            if self._has_rows() and not cache.lease(namespace, "frame", ttl=self.refresh_interval):
+                # Un'altra replica sta già rileggendo il foglio: si usa la copia locale
+                return None
+
+        with self._lock:
+            frame = self._materialize()
+            last_held = int(frame.index[-1]) if len(frame) else 1
+            start = 2 if full else max(2, self._first_missing_row() - 1)
+        return SyncPlan(self._range(start), start, last_held, full or start == 2, cache_version)
+
+    def _range(self, start):
+        last_col = re.sub(r"\d", "", rowcol_to_a1(1, len(self.columns)))
+        return absolute_range_name(self.worksheet_name, f"A{start}:{last_col}")
+
+    def _parse_values(self, start, values):
+        rows = [(start + offset, row_values) for offset, row_values in enumerate(values) if any(row_values)]
+        return parse_rows(
+            [row_values for _, row_values in rows], self.columns, self.dtypes,
+            index=pd.Index([row for row, _ in rows], dtype=np.int64, name="_row"),
+        )
+
+    def _apply_sync(self, plan, values):
+        read = self._parse_values(plan.start, values)
+        if plan.full:
+            self._replace(read, plan.start + len(values) - 1, plan.last_held)
+        elif self._matches(read, plan.start, plan.start + len(values) - 1):
+            self._merge(read)
+        else:
+            # Righe cancellate, inserite o modificate nel foglio: i numeri di riga non
+            # sono più affidabili, si rilegge tutto il foglio
+            with self._lock:
+                last_held = int(self._materialize().index[-1])
+            values = self._gateway.batch_get_values([self._range(2)])[0]
+            self._replace(self._parse_values(2, values), 1 + len(values), last_held)
+        cache = self._gateway.cache
+        if cache is not None:
+            with self._lock:
+                frame = self._materialize()
+            cache.set(f"ws:{self.worksheet_name}", "frame", frame, ttl=self.refresh_interval, version=plan.cache_version)
+        self._synced()
+
+    def _matches(self, read, start, end):
+        """True se le righe già presenti nell'intervallo letto [start, end] coincidono con il foglio.
+
+        La riga `start` è sempre presente nello store: se il foglio ora è più corto,
+        manca nella lettura e il confronto fallisce. Le righe oltre `end` possono
+        essere state scritte da questo processo dopo la lettura e non si confrontano.
+        """
+        with self._lock:
+            frame = self._materialize()
+        held = frame[(frame.index >= start) & (frame.index <= max(start, end))]
+        return _same_values(held, read.reindex(held.index))
+
+    def _replace(self, read, end, last_held):
+        """Sostituisce le righe fino a `end` con quelle lette dal foglio.
+
+        Restano le righe oltre `end` e oltre `last_held` (l'ultima presente quando
+        la lettura è partita): sono state scritte da questo processo nel frattempo.
+        """
+        with self._lock:
+            current = self._materialize()
+            self._frame = _concat_typed([read, current[current.index > max(end, last_held)]])
+            self._version += 1
+        self._last_full_sync = time.monotonic()
+
+    def _full_reload_due(self):
+        # Mai letto per intero (es. dopo un riavvio dallo snapshot): i numeri di riga non sono verificati
+        return self._last_full_sync is None or time.monotonic() - self._last_full_sync >= FULL_RELOAD_INTERVAL
+
+    def _is_fresh(self):
+        return self._last_sync is not None and time.monotonic() - self._last_sync < self.refresh_interval
+
+    def _synced(self):
+        self._last_sync = time.monotonic()
+        self.as_of = datetime.now(timezone.utc)
+        self._schedule_snapshot()
+
+    def _schedule_snapshot(self):
+        """Scrive lo snapshot in un thread in background, al massimo una volta ogni
+        `snapshot_interval`: la sincronizzazione può girare durante una pagina"""
+        if not self.snapshot_name:
+            return
+        with self._lock:
+            if self._snapshot_version == self._version or (self._snapshot_thread and self._snapshot_thread.is_alive()):
+                return
+            if self._last_snapshot is not None and time.monotonic() - self._last_snapshot < self.snapshot_interval:
+                return
+            self._last_snapshot = time.monotonic()
+            self._snapshot_thread = threading.Thread(target=self._write_snapshot, daemon=True)
+            self._snapshot_thread.start()
+
+    def _write_snapshot(self):
+        with self._lock:
+            frame = self._materialize()
+            version = self._version
+        # Il frame non viene mai modificato sul posto: si può scrivere senza il lock
+        write_snapshot(self.snapshot_name, frame.reset_index(), self.as_of)
+        self._snapshot_version = version
+
+    def _load_snapshot(self):
+        df, as_of = latest_snapshot(self.snapshot_name)
+        if df is None or list(df.columns) != ["_row"] + self.columns:
+            return
+        df = df.set_index(df["_row"].astype(np.int64)).drop(columns="_row")
+        self._merge(_conform(df, self.dtypes))
+        self._snapshot_version = self._version
+        self.as_of = as_of
+
+    def _merge(self, frame):
+        """Aggiunge le righe di `frame` che lo store non ha ancora"""
+        with self._lock:
+            current = self._materialize()
+            new_rows = frame[~frame.index.isin(current.index)]
+            if len(new_rows):
+                self._frame = _add_rows(current, new_rows)
+                self._version += 1
+
+    def _first_missing_row(self):
+        rows = self._materialize().index.to_numpy()
+        rows = rows[rows >= 2]  # la riga 1 è l'intestazione
+        expected = np.arange(2, 2 + len(rows))
+        gaps = np.flatnonzero(rows != expected)
+        return int(expected[gaps[0]]) if len(gaps) else 2 + len(rows)
+
+
+_background_lock = threading.Lock()
+
+
+def sync_stores(stores, force=False, background=False):
+    """Syncs several stores with a single batch read of all their missing tails.
+
+    Same rules as `WorksheetStore.sync`: stores refreshed less than
+    `refresh_interval` ago are skipped, and with `background=True` the read
+    runs in a daemon thread if every store to refresh already holds data.
+    All stores must share the same gateway.
+    """
+    stale = [store for store in stores if force or not store._is_fresh()]
+    if not stale:
+        return
+    if background and all(store._has_rows() for store in stale):
+        with _background_lock:
+            idle = [store for store in stale if not store.refreshing]
+            if idle:
+                thread = threading.Thread(target=sync_stores, args=(idle,), kwargs={"force": force}, daemon=True)
+                for store in idle:
+                    store._refresh_thread = thread
+                thread.start()
+        return
+
+    # Lock presi sempre nello stesso ordine, per sync concorrenti su insiemi diversi di store
+    stale = sorted(stale, key=lambda store: store.worksheet_name)
+    with ExitStack() as stack:
+        for store in stale:
+            stack.enter_context(store._sync_lock)
+        pending = []
+        for store in stale:
+            if not force and store._is_fresh():
+                continue
+            plan = store._plan_sync()
+            if plan is not None:
+                pending.append((store, plan))
+        if not pending:
+            return
+        values = pending[0][0]._gateway.batch_get_values([plan.range for _, plan in pending])
+        for (store, plan), store_values in zip(pending, values):
+            store._apply_sync(plan, store_values)
+
+
+@st.cache_resource
+def get_evaluation_store():
+    """Store delle valutazioni condiviso da tutte le sessioni e le pagine del processo"""
+    return WorksheetStore(get_gateway(), "evaluations", EVALUATION_COLUMNS, snapshot_name="evaluations", dtypes=EVALUATION_DTYPES)
+
+
+@st.cache_resource
+def get_user_store():
+    """Store degli utenti, condiviso come quello delle valutazioni"""
+    return WorksheetStore(get_gateway(), "users", USER_COLUMNS, snapshot_name="users", dtypes=USER_DTYPES)
@@ -0,0 +1,138 @@
+"""Finto Google Sheet in memoria, per sviluppo locale e prove di carico.
+
+Si attiva impostando `CLIMAISCORE_FAKE_SHEETS=1`. Latenza, errori 429 casuali e
+una quota al minuto sono configurabili per riprodurre il comportamento dell'API:
+
+    CLIMAISCORE_FAKE_SHEETS_LATENCY      secondi di latenza per chiamata (default 0)
+    CLIMAISCORE_FAKE_SHEETS_ERROR_RATE   probabilità di un 429 spontaneo (default 0)
+    CLIMAISCORE_FAKE_SHEETS_QUOTA        richieste/minuto prima dei 429 (default nessuna)
+    CLIMAISCORE_FAKE_SHEETS_STATS        file JSON aggiornato con i contatori delle chiamate
+                                         (usato da tools/loadtest.py)
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, numericise_all, rowcol_to_a1
+
+from utils.sheets import EVALUATION_COLUMNS, USER_COLUMNS
+
+
+def _api_error(code, message, status):
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message, "status": status}}).encode()
+    return APIError(response)
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets=None, latency=0.0, error_rate=0.0, quota_per_minute=None, seed=None, stats_path=None):
+        if worksheets is None:
+            worksheets = {"evaluations": EVALUATION_COLUMNS, "users": USER_COLUMNS}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self.calls = {}
+        self.throttled = 0
+        self.stats_path = stats_path
+        self._worksheets = {name: FakeWorksheet(self, name, header) for name, header in worksheets.items()}
+
+    @classmethod
+    def from_env(cls):
+        quota = os.environ.get("CLIMAISCORE_FAKE_SHEETS_QUOTA")
+        return cls(
+            latency=float(os.environ.get("CLIMAISCORE_FAKE_SHEETS_LATENCY", 0)),
+            error_rate=float(os.environ.get("CLIMAISCORE_FAKE_SHEETS_ERROR_RATE", 0)),
+            quota_per_minute=int(quota) if quota else None,
+            stats_path=os.environ.get("CLIMAISCORE_FAKE_SHEETS_STATS"),
+        )
+
+    def worksheet(self, name):
+        self._request("worksheet")
+        if name not in self._worksheets:
+            raise WorksheetNotFound(name)
+        return self._worksheets[name]
+
+    def values_batch_get(self, ranges, params=None):
+        self._request("values_batch_get")
+        value_ranges = []
+        for range_name in ranges:
+            title, _, cells = range_name.rpartition("!")
+            worksheet = self._worksheets.get(title.strip("'"))
+            if worksheet is None:
+                raise _api_error(400, f"Unable to parse range: {range_name}", "INVALID_ARGUMENT")
+            value_range = {"range": range_name, "majorDimension": "ROWS"}
+            values = worksheet._values(cells)
+            if values:
+                value_range["values"] = values
+            value_ranges.append(value_range)
+        return {"spreadsheetId": "fake", "valueRanges": value_ranges}
+
+    def _request(self, method):
+        """Simula una richiesta HTTP: conta la chiamata, applica latenza e quota"""
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            now = time.monotonic()
+            while self._requests and now - self._requests[0] > 60:
+                self._requests.popleft()
+            over_quota = self.quota_per_minute is not None and len(self._requests) >= self.quota_per_minute
+            if not over_quota:
+                self._requests.append(now)
+            flaky = self._random.random() < self.error_rate
+            if over_quota or flaky:
+                self.throttled += 1
+            if self.stats_path:
+                self._write_stats()
+        if self.latency:
+            time.sleep(self.latency)
+        if over_quota or flaky:
+            raise _api_error(429, "Quota exceeded for quota metric 'Read requests'", "RESOURCE_EXHAUSTED")
+
+    def _write_stats(self):
+        tmp_path = self.stats_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"calls": self.calls, "throttled": self.throttled}, f)
+        os.replace(tmp_path, self.stats_path)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, header):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._rows = [list(header)]
+        self._lock = threading.Lock()
+
+    def get_values(self, range_name=None):
+        self.spreadsheet._request("get_values")
+        return self._values(range_name)
+
+    def _values(self, range_name=None):
+        with self._lock:
+            rows = [list(r) for r in self._rows]
+        if range_name is None:
+            return rows
+        grid = a1_range_to_grid_range(range_name.split("!")[-1])
+        rows = rows[grid.get("startRowIndex", 0):grid.get("endRowIndex")]
+        return [r[grid.get("startColumnIndex", 0):grid.get("endColumnIndex")] for r in rows]
+
+    def get_all_records(self):
+        self.spreadsheet._request("get_all_records")
+        with self._lock:
+            header, *rows = [list(r) for r in self._rows]
+        return [dict(zip(header, numericise_all(row))) for row in rows]
+
+    def append_row(self, values):
+        self.spreadsheet._request("append_row")
+        with self._lock:
+            self._rows.append(["" if v is None else str(v) for v in values])
+            row = len(self._rows)
+        updated_range = f"{self.title}!A{row}:{rowcol_to_a1(row, len(values))}"
+        return {"updates": {"updatedRange": updated_range, "updatedRows": 1}}
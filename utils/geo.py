@@ -0,0 +1,78 @@
+"""Aggregazione spaziale vettorizzata dei punteggi su griglia esagonale (lat/lon)."""
+import numpy as np
+import pandas as pd
+
+SQRT3 = np.sqrt(3)
+
+
+def hex_bin(lat, lon, size):
+    """Assegna ogni punto a un esagono di lato `size` gradi (griglia pointy-top).
+
+    Restituisce le coordinate assiali intere (q, r) e il centro (lat, lon)
+    dell'esagono, tutto come array NumPy.
+    """
+    x = np.asarray(lon, dtype=float) / size
+    y = np.asarray(lat, dtype=float) / size
+    q = SQRT3 / 3 * x - y / 3
+    r = 2 / 3 * y
+
+    # Arrotondamento in coordinate cubiche: si corregge la componente con l'errore maggiore
+    cx, cz = q, r
+    cy = -cx - cz
+    rx, ry, rz = np.round(cx), np.round(cy), np.round(cz)
+    dx, dy, dz = np.abs(rx - cx), np.abs(ry - cy), np.abs(rz - cz)
+    fix_x = (dx > dy) & (dx > dz)
+    fix_y = ~fix_x & (dy > dz)
+    rx = np.where(fix_x, -ry - rz, rx)
+    rz = np.where(~fix_x & ~fix_y, -rx - ry, rz)
+
+    center_lon = size * SQRT3 * (rx + rz / 2)
+    center_lat = size * 1.5 * rz
+    return rx.astype(np.int64), rz.astype(np.int64), center_lat, center_lon
+
+
+def hexbin_scores(lat, lon, groups, scores, size):
+    """Media dei punteggi per (esagono, gruppo) in un solo passaggio vettorizzato.
+
+    `groups` sono codici interi (es. i codici categoriali dell'agent), `scores`
+    un DataFrame di punteggi con eventuali NaN. Restituisce un DataFrame con una
+    riga per bin non vuoto: q, r, group, center_lat, center_lon, count e la media
+    di ogni colonna di `scores`.
+    """
+    names = list(scores.columns)
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    groups = np.asarray(groups, dtype=np.int64)
+    scores = scores.to_numpy(dtype=float)
+
+    valid = ~np.isnan(lat) & ~np.isnan(lon)
+    lat, lon, groups, scores = lat[valid], lon[valid], groups[valid], scores[valid]
+    if len(lat) == 0:
+        return pd.DataFrame(columns=["q", "r", "group", "center_lat", "center_lon", "count"] + names)
+
+    q, r, center_lat, center_lon = hex_bin(lat, lon, size)
+    keys = np.stack([q, r, groups], axis=1)
+    bins, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    n_bins = len(bins)
+
+    present = ~np.isnan(scores)
+    filled = np.where(present, scores, 0.0)
+    means = np.empty((n_bins, scores.shape[1]))
+    for j in range(scores.shape[1]):
+        counts = np.bincount(inverse, weights=present[:, j], minlength=n_bins)
+        sums = np.bincount(inverse, weights=filled[:, j], minlength=n_bins)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[:, j] = sums / counts
+
+    result = pd.DataFrame({
+        "q": bins[:, 0],
+        "r": bins[:, 1],
+        "group": bins[:, 2],
+        "center_lat": center_lat[first],
+        "center_lon": center_lon[first],
+        "count": np.bincount(inverse, minlength=n_bins),
+    })
+    for j, name in enumerate(names):
+        result[name] = means[:, j]
+    return result
@@ -0,0 +1,59 @@
+"""Sezioni delle risposte pre-renderizzate in HTML sanificato.
+
+Il Markdown (tabelle "Evidence table" comprese) viene convertito una sola volta
+per contenuto: la pagina invia al browser solo i frammenti HTML già pronti.
+"""
+import hashlib
+
+import nh3
+import streamlit as st
+from markdown_it import MarkdownIt
+
+from utils.corpus import get_sections
+from utils.shared_cache import get_shared_cache
+
+# Stesso dialetto usato da st.markdown: CommonMark con tabelle e barrato, senza HTML grezzo
+_markdown = MarkdownIt("commonmark", {"html": False}).enable(["table", "strikethrough"])
+
+# Limite di frammenti tenuti in memoria (il corpus ha 4 sezioni per risposta)
+MAX_FRAGMENTS = 20000
+
+SECTION_CSS = """
+<style>
+.response-section table { border-collapse: collapse; width: 100%; margin-bottom: 1rem; font-size: 0.9rem; }
+.response-section th, .response-section td { border: 1px solid rgba(128, 128, 128, 0.3); padding: 0.25rem 0.5rem; vertical-align: top; }
+</style>
+"""
+
+
+def markdown_to_html(text):
+    """Markdown -> HTML sanificato"""
+    return f'<div class="response-section">{nh3.clean(_markdown.render(text))}</div>'
+
+
+@st.cache_resource
+def _fragments():
+    return {}
+
+
+def render_markdown(text):
+    """HTML di `text`, cachato per hash del contenuto e condiviso tra le sessioni"""
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    fragments = _fragments()
+    html = fragments.get(digest)
+    if html is None:
+        cache = get_shared_cache()
+        if cache is None:
+            html = markdown_to_html(text)
+        else:
+            html = cache.get_or_compute("html", digest, lambda: markdown_to_html(text))
+        if len(fragments) >= MAX_FRAGMENTS:
+            fragments.clear()
+        fragments[digest] = html
+    return html
+
+
+@st.cache_data
+def get_sections_html(agent_name, idx, version):
+    """Sezioni di una risposta già in HTML, una volta per versione del corpus"""
+    return {name: render_markdown(text) for name, text in get_sections(agent_name, idx, version).items()}
@@ -0,0 +1,157 @@
+"""Indice invertito sul corpus delle risposte, per la ricerca nella pagina Statistics.
+
+Ogni documento è un campo di una domanda (testo, tema, categoria) oppure una
+sezione della risposta di un agent. L'indice viene costruito una volta per
+versione del corpus e salvato come due tabelle Parquet (documenti e posting
+list ordinate per termine); in memoria i termini sono un array ordinato con
+gli offset delle rispettive posting list, quindi una ricerca è una manciata di
+`searchsorted` e `bincount`.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.corpus import load_corpus_table, split_sections
+from utils.text_features import CRITERION_SECTIONS
+
+INDEX_DIR = os.environ.get("CLIMAISCORE_INDEX_DIR", os.path.join("data", "index"))
+
+QUESTION_FIELDS = ["Question", "Theme", "Category"]
+SECTION_FIELDS = list(CRITERION_SECTIONS.values())
+SEARCH_FIELDS = QUESTION_FIELDS + SECTION_FIELDS
+
+_TOKEN = r"[^\W_]+"
+
+
+def tokenize(text):
+    return re.findall(_TOKEN, text.lower())
+
+
+def _documents(corpus):
+    """Tabella (question_id, agent, field, text); i campi della domanda hanno agent vuoto"""
+    questions = corpus.drop_duplicates("question_id")
+    frames = [
+        # L'id della domanda è indicizzato con il testo, per cercare direttamente "Q127"
+        questions[["question_id"]].assign(agent="", field="Question", text=questions["question_id"] + " " + questions["question_text"]),
+        questions[["question_id"]].assign(agent="", field="Theme", text=questions["theme"]),
+        questions[["question_id"]].assign(agent="", field="Category", text=questions["category"]),
+    ]
+    sections = corpus["response_text"].map(split_sections)
+    for section in SECTION_FIELDS:
+        frames.append(corpus[["question_id", "agent"]].assign(
+            field=section, text=sections.map(lambda s: s.get(section, ""))
+        ))
+    return pd.concat(frames, ignore_index=True).fillna({"text": ""})
+
+
+def build_index(corpus):
+    """(docs, postings): postings ha una riga per (termine, documento) con la frequenza del termine"""
+    documents = _documents(corpus)
+    tokens = documents["text"].str.lower().str.findall(_TOKEN).explode().dropna()
+    postings = tokens.groupby([tokens.to_numpy(), tokens.index]).size()
+    postings = pd.DataFrame({
+        "term": postings.index.get_level_values(0),
+        "doc_id": postings.index.get_level_values(1).astype(np.int32),
+        "tf": postings.to_numpy().astype(np.int16),
+    })
+    docs = pd.DataFrame({
+        "question_id": documents["question_id"].astype("category"),
+        "agent": documents["agent"].astype("category"),
+        "field": pd.Categorical(documents["field"], categories=SEARCH_FIELDS),
+    })
+    return docs, postings
+
+
+class InvertedIndex:
+    """Read-only inverted index: sorted terms, CSR posting lists and TF-IDF weights."""
+
+    def __init__(self, docs, postings):
+        self.docs = docs
+        terms = postings["term"].to_numpy(dtype=str)
+        self.terms, starts = np.unique(terms, return_index=True)
+        self._offsets = np.append(starts, len(terms))
+        self._doc_ids = postings["doc_id"].to_numpy()
+        df = np.diff(self._offsets)
+        idf = np.log(1 + len(docs) / df)
+        self._weights = postings["tf"].to_numpy() * np.repeat(idf, df)
+        self._questions = docs["question_id"].cat.codes.to_numpy()
+
+    def _postings(self, token, prefix=False):
+        """Posizioni nelle posting list del termine (o di tutti i termini con quel prefisso)"""
+        lo = np.searchsorted(self.terms, token)
+        hi = np.searchsorted(self.terms, token + "\uffff") if prefix else lo + (lo < len(self.terms) and self.terms[lo] == token)
+        return np.arange(self._offsets[lo], self._offsets[hi])
+
+    def _matches(self, query, fields=None):
+        """Per ogni token della query: (posizioni, documenti); l'ultimo token vale come prefisso"""
+        tokens = tokenize(query)
+        allowed = None if not fields else self.docs["field"].isin(fields).to_numpy()
+        matches = []
+        for i, token in enumerate(tokens):
+            positions = self._postings(token, prefix=i == len(tokens) - 1)
+            doc_ids = self._doc_ids[positions]
+            if allowed is not None:
+                keep = allowed[doc_ids]
+                positions, doc_ids = positions[keep], doc_ids[keep]
+            matches.append((positions, doc_ids))
+        return matches
+
+    def search(self, query, fields=None, limit=100):
+        """Domande che contengono tutti i termini della query (in un campo qualsiasi).
+
+        Restituisce question_id, score (somma dei pesi TF-IDF) e i campi in cui
+        compaiono i termini, dal risultato più rilevante.
+        """
+        matches = self._matches(query, fields)
+        n_questions = len(self.docs["question_id"].cat.categories)
+        if not matches:
+            return pd.DataFrame(columns=["question_id", "score", "matched_in"])
+        score = np.zeros(n_questions)
+        found = np.ones(n_questions, dtype=bool)
+        for positions, doc_ids in matches:
+            per_question = np.bincount(self._questions[doc_ids], weights=self._weights[positions], minlength=n_questions)
+            found &= per_question > 0
+            score += per_question
+        hits = np.flatnonzero(found)
+        hits = hits[np.argsort(-score[hits], kind="stable")][:limit]
+
+        matched_docs = np.unique(np.concatenate([doc_ids for _, doc_ids in matches]))
+        matched_docs = matched_docs[np.isin(self._questions[matched_docs], hits)]
+        matched = self.docs.iloc[matched_docs]
+        labels = np.where(matched["agent"] == "", matched["field"].astype(str),
+                          matched["agent"].astype(str) + " · " + matched["field"].astype(str))
+        matched_in = pd.Series(labels, index=matched["question_id"].astype(str)).groupby(level=0).agg(", ".join)
+
+        question_ids = self.docs["question_id"].cat.categories[hits]
+        return pd.DataFrame({
+            "question_id": question_ids,
+            "score": score[hits].round(2),
+            "matched_in": matched_in.reindex(question_ids).to_numpy(),
+        })
+
+    def matching_fields(self, query, question_id, fields=None):
+        """(agent, field) dei documenti di `question_id` che contengono almeno un termine della query"""
+        code = self.docs["question_id"].cat.categories.get_indexer([question_id])[0]
+        doc_ids = np.unique(np.concatenate([d for _, d in self._matches(query, fields)] or [np.array([], dtype=np.int32)]))
+        doc_ids = doc_ids[self._questions[doc_ids] == code]
+        matched = self.docs.iloc[doc_ids]
+        return list(zip(matched["agent"].astype(str), matched["field"].astype(str)))
+
+
+@st.cache_resource
+def load_search_index(version):
+    """Indice della versione del corpus, letto da disco se già costruito"""
+    docs_path = os.path.join(INDEX_DIR, f"search-{version}-docs.parquet")
+    postings_path = os.path.join(INDEX_DIR, f"search-{version}-postings.parquet")
+    if os.path.exists(docs_path) and os.path.exists(postings_path):
+        return InvertedIndex(pd.read_parquet(docs_path), pd.read_parquet(postings_path))
+    docs, postings = build_index(load_corpus_table(version))
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    for frame, path in ((docs, docs_path), (postings, postings_path)):
+        # Termini come dizionario Parquet: ogni termine è salvato una sola volta
+        frame.astype({"term": "category"} if "term" in frame else {}).to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+    return InvertedIndex(docs, postings)
@@ -0,0 +1,183 @@
+"""Cache condivisa tra più repliche Streamlit (opzionale).
+
+Si configura con la variabile d'ambiente `CLIMAISCORE_SHARED_CACHE` oppure con
+`[shared_cache] url = ...` nei secrets:
+
+    sqlite:///percorso/cache.db   file SQLite condiviso (stesso host o volume condiviso)
+    redis://host:6379/0           server Redis (richiede il pacchetto `redis`)
+
+Le chiavi sono raggruppate per namespace con un numero di versione: `invalidate()`
+incrementa la versione e rende irraggiungibili tutti i valori precedenti.
+"""
+import hashlib
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, self._expires(ttl)))
+        # Pulizia occasionale delle chiavi scadute
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+
+    def add(self, key, value, ttl=None):
+        """Scrive solo se la chiave non esiste (o è scaduta); True se scritta"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires IS NOT NULL AND expires <= ?", (key, time.time()))
+            cursor = conn.execute("INSERT OR IGNORE INTO cache VALUES (?, ?, ?)", (key, value, self._expires(ttl)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def incr(self, key, amount=1, ttl=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+            ).fetchone()
+            # La scadenza si fissa alla creazione del contatore
+            value, expires = (int(row[0]) + amount, row[1]) if row else (amount, self._expires(ttl))
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, expires))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    @staticmethod
+    def _expires(ttl):
+        return time.time() + ttl if ttl else None
+
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self._client.set(key, value, ex=int(ttl) if ttl else None, nx=True))
+
+    def incr(self, key, amount=1, ttl=None):
+        value = self._client.incrby(key, amount)
+        if ttl and value == amount:
+            self._client.expire(key, int(ttl))
+        return value
+
+
+class SharedCache:
+    """Versioned key/value cache on top of a SQLite or Redis backend."""
+
+    def __init__(self, backend, prefix="climaiscore"):
+        self._backend = backend
+        self.prefix = prefix
+
+    def version(self, namespace):
+        value = self._backend.get(f"{self.prefix}:version:{namespace}")
+        return int(value) if value is not None else 0
+
+    def invalidate(self, namespace):
+        """Bumps the namespace version; every value stored under it becomes stale."""
+        return self._backend.incr(f"{self.prefix}:version:{namespace}")
+
+    def incr_counter(self, key, amount=1, ttl=None):
+        """Atomically adds `amount` to the (unversioned) counter `key`; returns the new value."""
+        return self._backend.incr(f"{self.prefix}:counter:{key}", amount, ttl)
+
+    def get_counter(self, key):
+        value = self._backend.get(f"{self.prefix}:counter:{key}")
+        return int(value) if value is not None else 0
+
+    def get(self, namespace, key):
+        value = self._backend.get(self._key(namespace, key))
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, namespace, key, value, ttl=None, version=None):
+        """Stores `value`; pass the `version` read before computing it so that a
+        write happening in the meantime does not get hidden by a stale value."""
+        self._backend.set(self._key(namespace, key, version), pickle.dumps(value), ttl)
+
+    def lease(self, namespace, key, ttl=30):
+        """True for the single replica that should recompute `key` in this version."""
+        return self._backend.add(self._key(namespace, f"lease:{key}"), b"1", ttl)
+
+    def get_or_compute(self, namespace, key, compute, ttl=None):
+        value = self.get(namespace, key)
+        if value is None:
+            value = compute()
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def _key(self, namespace, key, version=None):
+        if version is None:
+            version = self.version(namespace)
+        return f"{self.prefix}:{namespace}:{version}:{key}"
+
+
+def frame_version(df):
+    """Hash del contenuto di un DataFrame, da usare come chiave di versione"""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()[:16]
+
+
+def _configured_url():
+    url = os.environ.get("CLIMAISCORE_SHARED_CACHE")
+    if url:
+        return url
+    try:
+        return st.secrets.get("shared_cache", {}).get("url")
+    except Exception:
+        # Nessun secrets.toml: la cache condivisa resta disattivata
+        return None
+
+
+@st.cache_resource
+def get_shared_cache():
+    """Cache condivisa configurata, oppure None se non è configurata"""
+    url = _configured_url()
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SharedCache(SQLiteBackend(url[len("sqlite:///"):]))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return SharedCache(RedisBackend(url))
+    raise ValueError(f"Unsupported shared cache url: {url}")
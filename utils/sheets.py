@@ -0,0 +1,305 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import gspread
+import streamlit as st
+from google.oauth2.service_account import Credentials
+
+from utils.shared_cache import get_shared_cache
+
+SCOPE = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# Quote Google Sheets API per utente (il service account): 60 richieste/minuto
+READ_QUOTA_PER_MINUTE = 60
+WRITE_QUOTA_PER_MINUTE = 60
+
+# Errori per cui ha senso riprovare (quota superata o errori transitori del server)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Intestazioni dei fogli, nell'ordine in cui vengono scritte le righe
+EVALUATION_COLUMNS = [
+    "user_id", "question_id", "agent", "relevance", "credibility", "uncertainty", "actionability",
+    # Tempi lato server: invio, comparsa della coppia, permanenza totale e per sezione (secondi)
+    "timestamp", "shown_at", "dwell_seconds",
+    "relevance_seconds", "credibility_seconds", "uncertainty_seconds", "actionability_seconds",
+]
+USER_COLUMNS = [
+    "user_id", "username", "background", "role", "institution",
+    "climate_experience", "education_level", "geographic_region", "ai_familiarity", "motivation",
+]
+
+
+class SlidingWindowLimiter:
+    """Rate limiter a finestra scorrevole: al massimo `limit` chiamate in qualsiasi intervallo di `window` secondi."""
+
+    def __init__(self, limit, window=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.limit = limit
+        self.window = window
+        self._clock = clock
+        self._sleep = sleep
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._calls and self._calls[0] + self.window <= now:
+            self._calls.popleft()
+
+    def acquire(self):
+        """Blocks until a call fits in the window; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._expire(now)
+                if len(self._calls) < self.limit:
+                    self._calls.append(now)
+                    return waited
+                # Si libera un posto quando la chiamata più vecchia esce dalla finestra
+                # (con un minimo, perché l'arrotondamento non la lasci appena dentro)
+                delay = max(self._calls[0] + self.window - now, 0.001)
+            self._sleep(delay)
+            waited += delay
+
+    def available(self):
+        with self._lock:
+            self._expire(self._clock())
+            return self.limit - len(self._calls)
+
+
+class SharedWindowLimiter:
+    """Rate limiter condiviso tra le repliche tramite i contatori della cache condivisa.
+
+    Le chiamate sono contate per slot di `window / slots` secondi (orologio di
+    sistema, comune alle repliche); una chiamata passa se lo slot corrente e i
+    `slots` precedenti restano entro `limit`, quindi in qualsiasi intervallo di
+    `window` secondi non passano più di `limit` chiamate in tutto il servizio.
+    """
+
+    def __init__(self, cache, name, limit, window=60.0, slots=6, clock=time.time, sleep=time.sleep):
+        self.cache = cache
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.slots = slots
+        self._slot_seconds = window / slots
+        self._clock = clock
+        self._sleep = sleep
+
+    def _key(self, slot):
+        return f"sheets-limiter:{self.name}:{slot}"
+
+    def _used_before(self, slot):
+        return sum(self.cache.get_counter(self._key(s)) for s in range(slot - self.slots, slot))
+
+    def acquire(self):
+        """Blocks until a call fits in the shared window; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            now = self._clock()
+            slot = int(now // self._slot_seconds)
+            # Il posto si prenota prima di contare: due repliche non possono prendere lo stesso
+            key = self._key(slot)
+            if self.cache.incr_counter(key, ttl=2 * self.window) + self._used_before(slot) <= self.limit:
+                return waited
+            self.cache.incr_counter(key, -1)
+            delay = max((slot + 1) * self._slot_seconds - now, 0.001)
+            self._sleep(delay)
+            waited += delay
+
+    def available(self):
+        slot = int(self._clock() // self._slot_seconds)
+        return max(0, self.limit - self.cache.get_counter(self._key(slot)) - self._used_before(slot))
+
+
+def _status_code(exc):
+    """Estrae lo status HTTP da un errore gspread (o da un errore con `response`)"""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code > 0:
+        return code
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class SheetsGateway:
+    """Single entry point to the spreadsheet shared by every session of the process.
+
+    Identical reads that are already in flight are coalesced into one API call,
+    every call goes through a sliding-window limiter sized to the Sheets quota, and
+    429/5xx responses are retried with exponential backoff and full jitter.
+    With a shared cache the limiter is shared between replicas and every
+    write invalidates the worksheet's namespace.
+    """
+
+    def __init__(
+        self,
+        spreadsheet,
+        read_quota_per_minute=READ_QUOTA_PER_MINUTE,
+        write_quota_per_minute=WRITE_QUOTA_PER_MINUTE,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=32.0,
+        sleep=time.sleep,
+        clock=None,
+        cache=None,
+    ):
+        self._spreadsheet = spreadsheet
+        self.cache = cache
+        self._worksheets = {}
+        if cache is None:
+            self._read_limiter = SlidingWindowLimiter(read_quota_per_minute, clock=clock or time.monotonic, sleep=sleep)
+            self._write_limiter = SlidingWindowLimiter(write_quota_per_minute, clock=clock or time.monotonic, sleep=sleep)
+        else:
+            # La quota è del service account, quindi di tutte le repliche insieme
+            self._read_limiter = SharedWindowLimiter(cache, "reads", read_quota_per_minute, clock=clock or time.time, sleep=sleep)
+            self._write_limiter = SharedWindowLimiter(cache, "writes", write_quota_per_minute, clock=clock or time.time, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {
+            "reads": 0,
+            "writes": 0,
+            "coalesced": 0,
+            "throttled": 0,
+            "retries": 0,
+            "failures": 0,
+            "shared_hits": 0,
+            "wait_seconds": 0.0,
+        }
+
+    # === Operazioni sul foglio ===
+    def batch_get_values(self, ranges):
+        """Values of several A1 ranges, also of different worksheets, in a single API call."""
+        ranges = list(ranges)
+        response = self._read(
+            ("values_batch_get", tuple(ranges)),
+            lambda: self._spreadsheet.values_batch_get(ranges),
+        )
+        # Gli intervalli vuoti non hanno la chiave "values"
+        return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+    def append_row(self, worksheet_name, values):
+        # Le scritture non vengono mai unite; si ritenta solo su 429, che garantisce
+        # che la riga non sia stata scritta
+        response = self._call(
+            self._write_limiter,
+            "writes",
+            lambda: self.worksheet(worksheet_name).append_row(values),
+            retry_on={429},
+        )
+        if self.cache is not None:
+            self.cache.invalidate(f"ws:{worksheet_name}")
+        return response
+
+    def worksheet(self, name):
+        ws = self._worksheets.get(name)
+        if ws is None:
+            ws = self._read(("worksheet", name), lambda: self._spreadsheet.worksheet(name))
+            self._worksheets[name] = ws
+        return ws
+
+    # === Metriche ===
+    def record_shared_hit(self):
+        """Counts a read served by the shared cache instead of the sheet."""
+        with self._lock:
+            self._stats["shared_hits"] += 1
+
+    def quota_status(self):
+        """Snapshot of the limiter headroom and of the call counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["inflight"] = len(self._inflight)
+        stats["read_available"] = self._read_limiter.available()
+        stats["read_limit"] = self._read_limiter.limit
+        stats["write_available"] = self._write_limiter.available()
+        stats["write_limit"] = self._write_limiter.limit
+        stats["read_headroom"] = stats["read_available"] / stats["read_limit"]
+        stats["write_headroom"] = stats["write_available"] / stats["write_limit"]
+        return stats
+
+    # === Meccanismi interni ===
+    def _read(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._stats["coalesced"] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(self._call(self._read_limiter, "reads", fn, retry_on=RETRYABLE_STATUS))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return future.result()
+
+    def _call(self, limiter, counter, fn, retry_on):
+        attempt = 0
+        while True:
+            waited = limiter.acquire()
+            with self._lock:
+                self._stats[counter] += 1
+                self._stats["wait_seconds"] += waited
+            try:
+                return fn()
+            except gspread.exceptions.APIError as e:
+                status = _status_code(e)
+                with self._lock:
+                    if status == 429:
+                        self._stats["throttled"] += 1
+                    if status not in retry_on or attempt >= self.max_retries:
+                        self._stats["failures"] += 1
+                        raise
+                    self._stats["retries"] += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0)
+                self._sleep(delay)
+                with self._lock:
+                    self._stats["wait_seconds"] += delay
+                attempt += 1
+
+
+def open_spreadsheet():
+    """Apre il Google Sheet configurato nei secrets (o il foglio finto locale)"""
+    if os.environ.get("CLIMAISCORE_FAKE_SHEETS"):
+        from utils.fake_sheets import FakeSpreadsheet
+        return FakeSpreadsheet.from_env()
+    credentials = Credentials.from_service_account_info(st.secrets["gspread"], scopes=SCOPE)
+    gc = gspread.authorize(credentials)
+    return gc.open_by_url(st.secrets["gspread"]["sheet_url"])
+
+
+@st.cache_resource
+def get_gateway():
+    """Gateway condiviso da tutte le sessioni e da tutte le pagine del processo"""
+    cache = get_shared_cache()
+    # Senza cache condivisa ogni replica ha il suo limiter: la quota si divide tra le repliche
+    replicas = 1 if cache is not None else max(1, int(os.environ.get("CLIMAISCORE_REPLICAS", 1)))
+    return SheetsGateway(
+        open_spreadsheet(),
+        read_quota_per_minute=READ_QUOTA_PER_MINUTE // replicas,
+        write_quota_per_minute=WRITE_QUOTA_PER_MINUTE // replicas,
+        cache=cache,
+    )
@@ -0,0 +1,55 @@
+"""Similarità TF-IDF tra le risposte dei diversi agent alla stessa domanda.
+
+Serve a riconoscere le coppie quasi identiche, che non vale la pena far valutare.
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from utils.corpus import load_corpus_table
+
+# Oltre questa similarità coseno due risposte sono considerate quasi duplicate
+SIMILARITY_THRESHOLD = 0.9
+
+
+@st.cache_data
+def load_pair_similarity(version):
+    """Similarità coseno per ogni domanda e ogni coppia di agent.
+
+    Tutte le coppie vengono calcolate con un unico prodotto sparso riga per riga
+    sulla matrice TF-IDF (righe già normalizzate L2).
+    """
+    corpus = load_corpus_table(version).reset_index(drop=True)
+    tfidf = TfidfVectorizer(sublinear_tf=True, stop_words="english", min_df=2).fit_transform(corpus["response_text"])
+
+    row_of = corpus.reset_index().set_index(["question_id", "agent"])["index"]
+    agents = sorted(corpus["agent"].unique())
+    left, right, agent_a, agent_b, questions = [], [], [], [], []
+    for a, b in combinations(agents, 2):
+        both = row_of.xs(a, level="agent").to_frame("a").join(row_of.xs(b, level="agent").rename("b"), how="inner")
+        left.append(both["a"].to_numpy())
+        right.append(both["b"].to_numpy())
+        questions.append(both.index.to_numpy())
+        agent_a += [a] * len(both)
+        agent_b += [b] * len(both)
+    left, right = np.concatenate(left), np.concatenate(right)
+
+    similarity = np.asarray(tfidf[left].multiply(tfidf[right]).sum(axis=1)).ravel()
+    return pd.DataFrame({
+        "question_id": np.concatenate(questions),
+        "agent_a": agent_a,
+        "agent_b": agent_b,
+        "similarity": similarity.astype(np.float32),
+    })
+
+
+def similarity_to(pair_similarity, agent):
+    """Similarità di ogni risposta con quella di `agent` alla stessa domanda,
+    indicizzata per (question_id, agent)"""
+    to_a = pair_similarity[pair_similarity["agent_a"] == agent].rename(columns={"agent_b": "agent"})
+    to_b = pair_similarity[pair_similarity["agent_b"] == agent].rename(columns={"agent_a": "agent"})
+    both = pd.concat([to_a[["question_id", "agent", "similarity"]], to_b[["question_id", "agent", "similarity"]]])
+    return both.set_index(["question_id", "agent"])["similarity"]
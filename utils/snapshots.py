@@ -0,0 +1,64 @@
+"""Snapshot Parquet versionati dei fogli, per ripartire subito dopo un riavvio.
+
+Ogni snapshot è un file `<nome>-<timestamp UTC>.parquet` nella cartella
+`CLIMAISCORE_SNAPSHOT_DIR` (default `data/snapshots`); il timestamp indica a
+quando risalgono i dati ("data as of").
+"""
+import glob
+import os
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+SNAPSHOT_DIR = os.environ.get("CLIMAISCORE_SNAPSHOT_DIR", os.path.join("data", "snapshots"))
+
+# Retention: al massimo gli ultimi SNAPSHOT_KEEP, e oltre SNAPSHOT_MAX_AGE solo il più recente
+SNAPSHOT_KEEP = 5
+SNAPSHOT_MAX_AGE = timedelta(days=7)
+
+_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+
+def _snapshot_files(name):
+    """Snapshot di `name` dal più recente al più vecchio, come (as_of, path)"""
+    snapshots = []
+    for path in glob.glob(os.path.join(SNAPSHOT_DIR, f"{name}-*.parquet")):
+        stamp = os.path.basename(path)[len(name) + 1:-len(".parquet")]
+        try:
+            as_of = datetime.strptime(stamp, _TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        snapshots.append((as_of, path))
+    return sorted(snapshots, reverse=True)
+
+
+def write_snapshot(name, df, as_of):
+    """Scrive uno snapshot in modo atomico e applica la retention"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"{name}-{as_of.strftime(_TIMESTAMP_FORMAT)}.parquet")
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    prune_snapshots(name)
+    return path
+
+
+def latest_snapshot(name):
+    """(DataFrame, as_of) dell'ultimo snapshot leggibile, oppure (None, None)"""
+    for as_of, path in _snapshot_files(name):
+        try:
+            return pd.read_parquet(path), as_of
+        except Exception:
+            # File corrotto o troncato: si prova con quello precedente
+            continue
+    return None, None
+
+
+def prune_snapshots(name, keep=SNAPSHOT_KEEP, max_age=SNAPSHOT_MAX_AGE):
+    now = datetime.now(timezone.utc)
+    for i, (as_of, path) in enumerate(_snapshot_files(name)):
+        if i >= keep or (i > 0 and now - as_of > max_age):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,97 @@
+"""Feature testuali delle risposte, per verificare se i punteggi premiano la lunghezza.
+
+Le feature vengono calcolate per ogni risposta e per ogni sezione in un solo
+passaggio vettorizzato sui metodi `.str` di pandas e salvate come tabella
+colonnare (Parquet) per versione del corpus.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.corpus import load_corpus_table, split_sections
+
+FEATURES_DIR = os.environ.get("CLIMAISCORE_FEATURES_DIR", os.path.join("data", "features"))
+
+FULL_RESPONSE = "Full response"
+
+# Sezione della risposta che i valutatori leggono per ciascun criterio
+CRITERION_SECTIONS = {
+    "relevance": "Executive summary",
+    "credibility": "Credibility",
+    "uncertainty": "Uncertainty",
+    "actionability": "Actionability",
+}
+
+FEATURE_COLUMNS = ["char_count", "word_count", "table_rows", "recommendations", "numeric_density"]
+
+# Feature usate per le correlazioni parziali: char_count è quasi collineare con word_count
+BIAS_FEATURES = ["word_count", "table_rows", "recommendations", "numeric_density"]
+
+_TABLE_ROW = r"(?m)^[ \t]*\|.*\|[ \t]*$"
+_TABLE_SEPARATOR = r"(?m)^[ \t]*\|[ \t:|-]*-[ \t:|-]*\|[ \t]*$"
+_LIST_ITEM = r"(?m)^[ \t]*(?:[-*+]|\d+[.)])[ \t]+\S"
+_NUMBER = r"(?<![\w.])[-+]?\d+(?:[.,]\d+)*(?:[ \t]*(?:%|°C|°))?"
+
+
+def _text_table(corpus):
+    """Tabella lunga (question_id, agent, section, text): risposta completa + sezioni"""
+    frames = [corpus[["question_id", "agent"]].assign(section=FULL_RESPONSE, text=corpus["response_text"])]
+    sections = corpus["response_text"].map(split_sections)
+    for section in CRITERION_SECTIONS.values():
+        frames.append(corpus[["question_id", "agent"]].assign(
+            section=section, text=sections.map(lambda s: s.get(section, ""))
+        ))
+    return pd.concat(frames, ignore_index=True)
+
+
+def compute_text_features(texts):
+    """Feature per ogni riga di `texts` (colonna `text`), tutte con operazioni vettorizzate"""
+    text = texts["text"].fillna("")
+    words = text.str.count(r"\S+")
+    table_lines = text.str.count(_TABLE_ROW)
+    separators = text.str.count(_TABLE_SEPARATOR)
+    features = pd.DataFrame({
+        "question_id": texts["question_id"].astype("category"),
+        "agent": texts["agent"].astype("category"),
+        "section": texts["section"].astype("category"),
+        "char_count": text.str.len().astype(np.int32),
+        "word_count": words.astype(np.int32),
+        # Righe di dati: si escludono separatori e intestazioni (una per tabella)
+        "table_rows": (table_lines - 2 * separators).clip(lower=0).astype(np.int16),
+        "recommendations": text.str.count(_LIST_ITEM).astype(np.int16),
+        # Valori numerici ogni 100 parole
+        "numeric_density": (100 * text.str.count(_NUMBER) / words.where(words > 0)).fillna(0).astype(np.float32),
+    })
+    return features
+
+
+@st.cache_data
+def load_text_features(version):
+    """Tabella delle feature per la versione del corpus, letta da disco se già calcolata"""
+    path = os.path.join(FEATURES_DIR, f"text_features-{version}.parquet")
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    features = compute_text_features(_text_table(load_corpus_table(version)))
+    os.makedirs(FEATURES_DIR, exist_ok=True)
+    features.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return features
+
+
+def partial_correlations(df, features, target):
+    """Correlazione parziale tra ogni feature e `target`, controllando per le altre feature.
+
+    Calcolata dalla matrice di precisione (inversa della matrice di correlazione);
+    restituisce una Series indicizzata per feature, NaN se i dati non bastano.
+    """
+    data = df[features + [target]].dropna()
+    data = data.loc[:, data.std() > 0]
+    if target not in data.columns or len(data) <= len(data.columns) + 1:
+        return pd.Series(np.nan, index=features)
+    precision = np.linalg.pinv(np.corrcoef(data.to_numpy(dtype=float), rowvar=False))
+    t = data.columns.get_loc(target)
+    diag = np.sqrt(np.diag(precision))
+    partial = -precision[:, t] / (diag * diag[t])
+    return pd.Series(partial[:-1], index=data.columns[:-1]).reindex(features)